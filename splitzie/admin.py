@@ -1,10 +1,47 @@
 from django.contrib import admin
+from django.db.models import F
+from django.utils import timezone
 
 from splitzie import models
 
 
+class BumpVersionMixin:
+    """Bumps the group version after changes, like the group pages do.
+
+    Otherwise the cached page fragments and ETags of the group stay stale.
+    """
+
+    # Field with the ID of the group
+    group_field = "group_id"
+
+    def save_related(self, request, form, formsets, change):
+        # Called after saving the object and the inlines
+        super().save_related(request, form, formsets, change)
+        models.Group.objects.get(
+            pk=getattr(form.instance, self.group_field)
+        ).bump_version()
+
+    def delete_model(self, request, obj):
+        pk = getattr(obj, self.group_field)
+        super().delete_model(request, obj)
+        self.bump_deleted([pk])
+
+    def delete_queryset(self, request, queryset):
+        pks = list(queryset.values_list(self.group_field, flat=True))
+        super().delete_queryset(request, queryset)
+        self.bump_deleted(pks)
+
+    @staticmethod
+    def bump_deleted(pks: list[int]):
+        # Like entry_deleted, deleted groups are skipped
+        models.Group.objects.filter(pk__in=pks).update(
+            version=F("version") + 1, changed_at=timezone.now()
+        )
+
+
 class ParticipantInline(admin.TabularInline):
     model = models.Participant
+    readonly_fields = ("balance",)
 
 
 class EmailInline(admin.TabularInline):
@@ -12,24 +49,44 @@ class EmailInline(admin.TabularInline):
 
 
 @admin.register(models.Group)
-class GroupAdmin(admin.ModelAdmin):
+class GroupAdmin(BumpVersionMixin, admin.ModelAdmin):
     search_fields = ("name",)
     ordering = ("name",)
-    readonly_fields = ("code", "created_at",)
+    readonly_fields = (
+        "code",
+        "created_at",
+    )
     inlines = [ParticipantInline, EmailInline]
 
+    group_field = "pk"
+
 
 class EntryInline(admin.TabularInline):
+    # Read-only, because the participant balances are only maintained when
+    # saving or deleting payments
     model = models.Entry
+    readonly_fields = ("participant", "amount")
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
 
 
 @admin.register(models.Payment)
-class PaymentAdmin(admin.ModelAdmin):
+class PaymentAdmin(BumpVersionMixin, admin.ModelAdmin):
     readonly_fields = ("created_at",)
     inlines = [EntryInline]
 
 
 @admin.register(models.Expense)
-class ExpenseAdmin(admin.ModelAdmin):
+class ExpenseAdmin(BumpVersionMixin, admin.ModelAdmin):
     readonly_fields = ("created_at",)
     inlines = [EntryInline]
+
+
+@admin.register(models.QueuedMail)
+class QueuedMailAdmin(admin.ModelAdmin):
+    list_display = ("subject", "to", "created_at", "attempts", "sent_at")
+    list_filter = ("sent_at",)
+    readonly_fields = ("created_at",)
@@ -0,0 +1,123 @@
+"""Benchmark of the settle engines on generated balances.
+
+Run it using the settle_benchmark command.
+"""
+
+import random
+import statistics
+import time
+from decimal import Decimal
+from typing import Callable, NamedTuple
+
+from splitzie.settle import Settler, SettleEntry
+
+
+def big_payer(n: int, rng: random.Random) -> list[int]:
+    """One participant paid for everyone."""
+    debts = [-rng.randint(100, 10000) for _ in range(n - 1)]
+    return [-sum(debts)] + debts
+
+
+def uniform(n: int, rng: random.Random) -> list[int]:
+    """Uniformly distributed balances."""
+    balances = [rng.choice([-1, 1]) * rng.randint(1, 10000) for _ in range(n - 1)]
+    return balances + [-sum(balances)]
+
+
+def small_debts(n: int, rng: random.Random) -> list[int]:
+    """Many small debts to a few creditors."""
+    creditors = max(1, n // 10)
+    debts = [-rng.randint(1, 500) for _ in range(n - creditors)]
+    # Divide the total over the creditors
+    total = -sum(debts)
+    cuts = sorted(rng.sample(range(1, total), creditors - 1))
+    credits = [b - a for a, b in zip([0] + cuts, cuts + [total])]
+    return credits + debts
+
+
+def cancelling_pairs(n: int, rng: random.Random) -> list[int]:
+    """Pairs of opposite balances, plus uniform balances when n is odd."""
+    balances = []
+    for _ in range(n // 2 - n % 2):
+        amount = rng.randint(1, 10000)
+        balances += [amount, -amount]
+    if n % 2:
+        balances += uniform(3, rng)
+    return balances
+
+
+DISTRIBUTIONS: dict[str, Callable[[int, random.Random], list[int]]] = {
+    "big_payer": big_payer,
+    "uniform": uniform,
+    "small_debts": small_debts,
+    "cancelling_pairs": cancelling_pairs,
+}
+
+ENGINES: dict[str, Callable[[Settler], list]] = {
+    **{
+        strategy: lambda s, strategy=strategy: s.get_heuristic(strategy)
+        for strategy in Settler.STRATEGIES
+    },
+    "brute_force": Settler.get_optimal_brute_force,
+    "optimal": Settler.get_optimal,
+}
+
+
+class Result(NamedTuple):
+    distribution: str
+    size: int
+    engine: str
+    latency: float
+    max_latency: float
+    moves: float
+    saved: float
+
+
+def generate(distribution: str, n: int, rng: random.Random) -> list[SettleEntry]:
+    """Generates n non-zero balances that sum to 0."""
+    while True:
+        cents = DISTRIBUTIONS[distribution](n, rng)
+        if 0 not in cents:
+            break
+    rng.shuffle(cents)
+    return [SettleEntry(i, Decimal(c).scaleb(-2)) for i, c in enumerate(cents)]
+
+
+def run(
+    sizes: list[int],
+    distributions: list[str],
+    engines: list[str],
+    repeat: int = 5,
+    seed: int = 0,
+) -> list[Result]:
+    """Times each engine on the same generated balances.
+
+    Returns:
+        The mean latency (in seconds), maximum latency, mean number of moves
+        and mean number of moves saved compared to greedy, for each
+        distribution, size and engine.
+    """
+    results = []
+    for distribution in distributions:
+        for size in sizes:
+            rng = random.Random(f"{seed}-{distribution}-{size}")
+            samples = [generate(distribution, size, rng) for _ in range(repeat)]
+            greedy = [len(ENGINES["greedy"](Settler(e))) for e in samples]
+            for engine in engines:
+                latencies, moves = [], []
+                for entries in samples:
+                    start = time.perf_counter()
+                    moves.append(len(ENGINES[engine](Settler(entries))))
+                    latencies.append(time.perf_counter() - start)
+                results.append(
+                    Result(
+                        distribution,
+                        size,
+                        engine,
+                        statistics.mean(latencies),
+                        max(latencies),
+                        statistics.mean(moves),
+                        statistics.mean(greedy) - statistics.mean(moves),
+                    )
+                )
+    return results
@@ -0,0 +1,89 @@
+"""Export of the group ledger, as CSV or newline-delimited JSON.
+
+The rows are generated from a server-side cursor, so that large groups can
+be streamed in constant memory.
+"""
+
+import csv
+import json
+from typing import Iterator
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from splitzie.models import Group, Entry
+
+# One row per entry, with the payment and expense details repeated
+FIELDS = [
+    "payment",
+    "created_at",
+    "type",
+    "description",
+    "payer",
+    "total",
+    "participant",
+    "amount",
+]
+
+
+def ledger_rows(group: Group, chunk_size: int = 2000) -> Iterator[dict]:
+    """Yields the entries of the group, oldest payment first."""
+    entries = (
+        Entry.objects.filter(payment__group=group)
+        .select_related("participant", "payment__expense__payer")
+        .order_by("payment__created_at", "payment_id", "id")
+    )
+    for entry in entries.iterator(chunk_size=chunk_size):
+        payment = entry.payment
+        expense = getattr(payment, "expense", None)
+        yield {
+            "payment": payment.pk,
+            "created_at": payment.created_at,
+            "type": payment.type,
+            "description": expense.description if expense else "",
+            "payer": expense.payer.name if expense else "",
+            "total": expense.amount if expense else None,
+            "participant": entry.participant.name,
+            "amount": entry.amount,
+        }
+
+
+class _Echo:
+    """File-like object that returns what is written, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+# Cells starting with these characters are executed as formulas by spreadsheets
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+def _escape_formula(value):
+    """Prefixes text that would be executed as formula with a quote."""
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def csv_lines(rows: Iterator[dict]) -> Iterator[str]:
+    """Yields the CSV lines.
+
+    The names and descriptions are entered by the group members, so the text
+    cells are escaped against formula injection.
+    """
+    writer = csv.DictWriter(_Echo(), FIELDS)
+    yield writer.writeheader()
+    for row in rows:
+        row = {k: _escape_formula(v) for k, v in row.items()}
+        yield writer.writerow({**row, "created_at": row["created_at"].isoformat()})
+
+
+def ndjson_lines(rows: Iterator[dict]) -> Iterator[str]:
+    for row in rows:
+        yield json.dumps(row, cls=DjangoJSONEncoder) + "\n"
+
+
+FORMATS = {
+    "csv": ("text/csv", csv_lines),
+    "ndjson": ("application/x-ndjson", ndjson_lines),
+}
@@ -1,45 +1,36 @@
 from decimal import Decimal
+from typing import Iterable
 
 from django import forms
 from django.core.exceptions import ValidationError
 from django.db import transaction
 from django.utils.translation import gettext_lazy as _
 
-from splitzie.mail import send_rendered_mail
-from splitzie.models import Expense, Participant, Entry, Payment
+from splitzie import importer
+from splitzie.models import Expense, Participant, Entry, Payment, Group
 
 
-class ExpenseForm(forms.ModelForm):
-    type = forms.ChoiceField(
-        choices=[("expense", _("Expense")), ("income", _("Income"))]
-    )
-    amount = forms.DecimalField(
-        max_digits=7, decimal_places=2, min_value=Decimal("0.00")
-    )
+class DivisionMixin:
+    """Validates the division of an expense over the participants.
 
-    class Meta:
-        model = Expense
-        fields = ["amount", "payer", "description", "image"]
+    The form must have the type and amount fields and a field for each
+    participant.
+    """
 
-    def __init__(self, *args, instance: Expense = None, **kwargs):
-        super().__init__(*args, instance=instance, **kwargs)
-        self.participants = Participant.objects.filter(group=instance.group)
+    participants: Iterable[Participant]
 
-        # Fields for each participant
+    def add_participant_fields(self):
         for participant in self.participants:
             self.fields[f"participant-{participant.pk}"] = forms.DecimalField(
                 max_digits=7, decimal_places=2, required=False
             )
 
-        # Payer must be participant
-        self.fields["payer"].queryset = self.participants
-
     def clean(self):
         cleaned_data = super().clean()
 
         # Sum of division must be equal to total amount
         division_sum = sum(
-            cleaned_data.get(f"participant-{p.pk}", 0) for p in self.participants
+            cleaned_data.get(f"participant-{p.pk}") or 0 for p in self.participants
         )
         if division_sum != cleaned_data.get("amount", 0):
             raise ValidationError("Division values do not sum up to the total amount.")
@@ -50,34 +41,56 @@ class ExpenseForm(forms.ModelForm):
 
         return cleaned_data
 
-    def save(self, commit=True):
-        obj = super().save(commit=False)  # type: Expense
-
-        if not commit:
-            return obj
-
+    def get_entries(self, expense: Expense) -> list[Entry]:
         def get_amount(p: Participant):
             """Entry amount depends on type and whether the participant is payer/receiver."""
-            amount = self.cleaned_data.get(f"participant-{p.pk}", 0)
+            amount = self.cleaned_data.get(f"participant-{p.pk}") or 0
 
             # Flip sign when expense
             if self.cleaned_data["type"] == "expense":
                 amount *= -1
 
-            if p == obj.payer:
-                amount -= obj.amount
+            if p == expense.payer:
+                amount -= expense.amount
 
             return amount
 
+        return [
+            Entry(payment=expense, participant=p, amount=get_amount(p))
+            for p in self.participants
+        ]
+
+
+class ExpenseForm(DivisionMixin, forms.ModelForm):
+    type = forms.ChoiceField(
+        choices=[("expense", _("Expense")), ("income", _("Income"))]
+    )
+    amount = forms.DecimalField(
+        max_digits=7, decimal_places=2, min_value=Decimal("0.00")
+    )
+
+    class Meta:
+        model = Expense
+        fields = ["amount", "payer", "description", "image"]
+
+    def __init__(self, *args, instance: Expense = None, **kwargs):
+        super().__init__(*args, instance=instance, **kwargs)
+        self.participants = Participant.objects.filter(group=instance.group)
+
+        # Fields for each participant
+        self.add_participant_fields()
+
+        # Payer must be participant
+        self.fields["payer"].queryset = self.participants
+
+    def save(self, commit=True):
+        obj = super().save(commit=False)  # type: Expense
+
+        if not commit:
+            return obj
+
         with transaction.atomic():
-            obj.save_with_entries(
-                Entry(
-                    payment=obj,
-                    participant=p,
-                    amount=get_amount(p),
-                )
-                for p in self.participants
-            )
+            obj.save_with_entries(self.get_entries(obj))
 
             obj.group.send_mail(
                 "splitzie/mails/expense_created.txt",
@@ -88,6 +101,121 @@ class ExpenseForm(forms.ModelForm):
         return obj
 
 
+class ExpenseRowForm(DivisionMixin, forms.Form):
+    """A row of the bulk import, validated without queries.
+
+    The payer and the division are given by participant name.
+    """
+
+    created_at = forms.DateTimeField(required=False)
+    type = forms.ChoiceField(choices=[("expense", "expense"), ("income", "income")])
+    amount = forms.DecimalField(
+        max_digits=7, decimal_places=2, min_value=Decimal("0.00")
+    )
+    description = forms.CharField(max_length=150)
+    payer = forms.TypedChoiceField()
+
+    def __init__(self, row: dict, participants: list[Participant]):
+        self.participants = participants
+        by_name = {p.name: p for p in participants}
+        data = {k: row.get(k) for k in importer.FIELDS}
+        division = row.get("division") or {}
+        # JSON rows can have any value, which is reported by clean
+        self.invalid_division = not isinstance(division, dict)
+        if self.invalid_division:
+            division = {}
+        for name, value in division.items():
+            if name in by_name:
+                data[f"participant-{by_name[name].pk}"] = value
+        super().__init__(data)
+        self.unknown_names = [name for name in division if name not in by_name]
+
+        self.add_participant_fields()
+        self.fields["payer"].choices = [(name, name) for name in by_name]
+        self.fields["payer"].coerce = by_name.get
+
+    def clean(self):
+        if self.invalid_division:
+            raise ValidationError(
+                "The division must be an object with the amount per participant."
+            )
+        if self.unknown_names:
+            raise ValidationError(
+                "Unknown participant(s): " + ", ".join(self.unknown_names)
+            )
+        return super().clean()
+
+    def get_expense(self, group: Group) -> Expense:
+        return Expense(
+            group=group,
+            type="expense",
+            created_at=self.cleaned_data["created_at"],
+            amount=self.cleaned_data["amount"],
+            payer=self.cleaned_data["payer"],
+            description=self.cleaned_data["description"],
+        )
+
+
+class ExpenseImportForm(forms.Form):
+    """Imports the expenses from a CSV or JSON file, see splitzie.importer.
+
+    All rows are validated before anything is saved.
+    """
+
+    file = forms.FileField(label=_("File"))
+
+    def __init__(self, *args, group: Group, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.group = group
+        self.expenses = []
+
+    def clean_file(self):
+        file = self.cleaned_data["file"]
+        try:
+            rows = importer.parse(file, file.name)
+        except ValueError as e:
+            raise ValidationError(f"Could not read the file: {e}")
+        if not rows:
+            raise ValidationError("The file contains no expenses.")
+
+        participants = list(self.group.participants.all())
+        errors = []
+        for i, row in enumerate(rows, 1):
+            row_form = ExpenseRowForm(row, participants)
+            if row_form.is_valid():
+                expense = row_form.get_expense(self.group)
+                entries = row_form.get_entries(expense)
+                if any(e.amount for e in entries):
+                    self.expenses.append((expense, entries))
+                else:
+                    errors.append(f"Row {i}: The payment does not change any balance.")
+            else:
+                errors += [
+                    (
+                        f"Row {i}: {field}: {message}"
+                        if field != "__all__"
+                        else f"Row {i}: {message}"
+                    )
+                    for field, messages in row_form.errors.items()
+                    for message in messages
+                ]
+        if errors:
+            raise ValidationError(errors)
+        return file
+
+    def save(self) -> list[Expense]:
+        """Saves the expenses and sends a single summary mail."""
+        expenses = [expense for expense, entries in self.expenses]
+        with transaction.atomic():
+            Expense.bulk_save_with_entries(self.group, self.expenses)
+            self.group.send_mail(
+                "splitzie/mails/expenses_imported.txt",
+                "splitzie/mails/expenses_imported_subject.txt",
+                {"group": self.group, "expenses": expenses},
+            )
+        return expenses
+
+
 class SettleForm(forms.ModelForm):
     debtor = forms.ModelChoiceField(queryset=Participant.objects.none())
     creditor = forms.ModelChoiceField(queryset=Participant.objects.none())
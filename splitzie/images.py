@@ -0,0 +1,35 @@
+"""Processing of uploaded receipt images, see the process_images command."""
+
+import io
+from typing import IO
+
+from django.conf import settings
+from PIL import Image, ImageOps
+
+
+def _encode(image: Image.Image) -> bytes:
+    buffered = io.BytesIO()
+    # Metadata such as EXIF is not copied unless it is passed explicitly
+    image.save(
+        buffered,
+        settings.EXPENSE_IMAGE_FORMAT,
+        quality=settings.EXPENSE_IMAGE_QUALITY,
+    )
+    return buffered.getvalue()
+
+
+def process(file: IO[bytes]) -> tuple[bytes, bytes]:
+    """Downscales and re-encodes the image, without metadata.
+
+    Returns:
+        The encoded image and thumbnail.
+    """
+    with Image.open(file) as image:
+        # Apply the EXIF orientation, because the EXIF data is dropped
+        image = ImageOps.exif_transpose(image).convert("RGB")
+    size = settings.EXPENSE_IMAGE_MAX_SIZE
+    image.thumbnail((size, size))
+    thumbnail = image.copy()
+    size = settings.EXPENSE_IMAGE_THUMBNAIL_SIZE
+    thumbnail.thumbnail((size, size))
+    return _encode(image), _encode(thumbnail)
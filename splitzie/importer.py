@@ -0,0 +1,66 @@
+"""Parsing of expense files for the bulk import.
+
+CSV files have the columns created_at (optional), type (expense or income),
+description, payer and amount, and a column for each participant with the
+division, named after the participant.
+
+JSON files contain a list of objects with the same keys, except that the
+division is given as an object in the division key, e.g.:
+
+    [{"type": "expense", "description": "Groceries", "payer": "Alice",
+      "amount": "10.00", "division": {"Alice": "5.00", "Bob": "5.00"}}]
+"""
+
+import csv
+import io
+import json
+from typing import IO
+
+FIELDS = ["created_at", "type", "description", "payer", "amount"]
+
+
+def parse_csv(file: IO[str]) -> list[dict]:
+    rows = []
+    try:
+        for row in csv.DictReader(file):
+            rows.append(
+                {
+                    **{k: row.pop(k, None) for k in FIELDS},
+                    "division": {
+                        name: value for name, value in row.items() if name and value
+                    },
+                }
+            )
+    except csv.Error as e:
+        raise ValueError(str(e))
+    return rows
+
+
+def parse_json(file: IO[str]) -> list[dict]:
+    rows = json.load(file)
+    if not isinstance(rows, list) or not all(isinstance(r, dict) for r in rows):
+        raise ValueError("Expected a list of objects")
+    return rows
+
+
+FORMATS = {
+    "csv": parse_csv,
+    "json": parse_json,
+}
+
+
+def parse(file: IO[bytes], name: str) -> list[dict]:
+    """Parses the file, using the format of the file name extension.
+
+    Raises:
+        ValueError: When the format is unknown or the file is invalid.
+    """
+    extension = name.rsplit(".", 1)[-1].lower()
+    if extension not in FORMATS:
+        raise ValueError(f"Unknown format {extension!r}, use CSV or JSON")
+    text = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+    try:
+        return FORMATS[extension](text)
+    finally:
+        # Don't close the underlying file
+        text.detach()
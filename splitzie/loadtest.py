@@ -0,0 +1,144 @@
+"""Load test scenario of the group pages, using the Django test client.
+
+Run it using the load_test command, after seeding groups with seed_load. The
+requests are handled in process, so the latencies exclude the web server but
+include the database.
+"""
+
+import random
+import statistics
+import time
+from decimal import Decimal
+from typing import Callable, NamedTuple
+
+from django.conf import settings
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from splitzie.models import Group
+
+
+def view_group(client: Client, group: Group, rng: random.Random):
+    return client.get(reverse("group", args=(group.code,)))
+
+
+def view_table(client: Client, group: Group, rng: random.Random):
+    return client.get(reverse("group-table", args=(group.code,)))
+
+
+def view_table_running(client: Client, group: Group, rng: random.Random):
+    return client.get(reverse("group-table", args=(group.code,)), {"running": "1"})
+
+
+def view_settle(client: Client, group: Group, rng: random.Random):
+    return client.get(reverse("group-settle", args=(group.code,)))
+
+
+def create_expense(client: Client, group: Group, rng: random.Random):
+    payer, other = rng.sample(list(group.participants.all()), 2)
+    amount = Decimal(rng.randint(100, 10000)).scaleb(-2)
+    return client.post(
+        reverse("expense-create", args=(group.code,)),
+        {
+            "type": "expense",
+            "amount": amount,
+            "payer": payer.pk,
+            "description": "Load test",
+            f"participant-{other.pk}": amount,
+        },
+    )
+
+
+def create_settlement(client: Client, group: Group, rng: random.Random):
+    debtor, creditor = rng.sample(list(group.participants.all()), 2)
+    return client.post(
+        reverse("group-settle", args=(group.code,)),
+        {"debtor": debtor.pk, "creditor": creditor.pk, "amount": "1.00"},
+    )
+
+
+def edit_group(client: Client, group: Group, rng: random.Random):
+    return client.post(
+        reverse("group-edit", args=(group.code,)),
+        {"form": "name", "name": f"Load test {rng.randint(0, 1000)}"},
+    )
+
+
+# The steps of each iteration, in order
+SCENARIO: dict[str, Callable[[Client, Group, random.Random], object]] = {
+    "group": view_group,
+    "table": view_table,
+    "table running": view_table_running,
+    "settle": view_settle,
+    "create expense": create_expense,
+    "group after change": view_group,
+    "create settlement": create_settlement,
+    "edit group": edit_group,
+}
+
+
+class Result(NamedTuple):
+    endpoint: str
+    requests: int
+    errors: int
+    p50: float
+    p95: float
+    p99: float
+    queries: float
+    max_queries: int
+
+
+def percentiles(latencies: list[float]) -> tuple[float, float, float]:
+    """Returns the 50th, 95th and 99th percentile."""
+    if len(latencies) == 1:
+        return latencies[0], latencies[0], latencies[0]
+    cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+    return cuts[49], cuts[94], cuts[98]
+
+
+def run(
+    groups: list[Group], iterations: int, steps: list[str], seed: int = 0
+) -> list[Result]:
+    """Runs the scenario steps on random groups.
+
+    The groups should have their participants prefetched, so that the steps
+    don't need queries besides the requests.
+
+    Returns:
+        The number of requests, number of error responses, latency
+        percentiles (in seconds) and mean and maximum number of queries, for
+        each step.
+    """
+    rng = random.Random(seed)
+    # Deployments only support HTTPS. Exceptions are counted as errors.
+    client = Client(
+        raise_request_exception=False,
+        **{"wsgi.url_scheme": "https", "SERVER_PORT": "443"},
+    )
+    latencies = {step: [] for step in steps}
+    queries = {step: [] for step in steps}
+    errors = {step: 0 for step in steps}
+    with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"]):
+        for _ in range(iterations):
+            group = rng.choice(groups)
+            for step in steps:
+                with CaptureQueriesContext(connection) as context:
+                    start = time.perf_counter()
+                    response = SCENARIO[step](client, group, rng)
+                    latencies[step].append(time.perf_counter() - start)
+                queries[step].append(len(context.captured_queries))
+                if response.status_code >= 400:
+                    errors[step] += 1
+    return [
+        Result(
+            step,
+            len(latencies[step]),
+            errors[step],
+            *percentiles(latencies[step]),
+            statistics.mean(queries[step]),
+            max(queries[step]),
+        )
+        for step in steps
+    ]
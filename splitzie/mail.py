@@ -1,17 +1,40 @@
-from django.core.mail import send_mail, EmailMessage
+from django.core.mail import EmailMessage
 from django.template import loader
 
 
-def send_rendered_mail(
+def render_mail(
+    email_template_name: str, subject_template_name: str, context: dict = None
+) -> tuple[str, str]:
+    """Returns the rendered subject and message."""
+    subject = loader.render_to_string(subject_template_name, context).strip()
+    message = loader.render_to_string(email_template_name, context).strip()
+    return subject, message
+
+
+def make_message(subject: str, message: str, recipient_list: list[str], **kwargs):
+    return EmailMessage(
+        subject,
+        message,
+        to=recipient_list,
+        headers={"X-Entity-Ref-ID": "null"},
+        **kwargs,
+    )
+
+
+def queue_rendered_mail(
     email_template_name: str,
     subject_template_name: str,
     recipient_list: list[str],
     context: dict = None,
 ):
-    subject = loader.render_to_string(subject_template_name, context).strip()
-    message = loader.render_to_string(email_template_name, context).strip()
+    """Queues the mail, to be sent by the send_queued_mail command.
+
+    When called inside a transaction, the mail is only sent if the
+    transaction is committed.
+    """
+    from splitzie.models import QueuedMail
 
-    email = EmailMessage(
-        subject, message, to=recipient_list, headers={"X-Entity-Ref-ID": "null"}
+    subject, message = render_mail(email_template_name, subject_template_name, context)
+    QueuedMail.objects.bulk_create(
+        QueuedMail(to=to, subject=subject, body=message) for to in recipient_list
     )
-    email.send()
@@ -0,0 +1,83 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from splitzie.models import BalanceCheckpoint, Entry, Group
+from splitzie.views import PaymentPageMixin
+
+
+class Command(BaseCommand):
+    help = "Prints the query plans of the hot queries, to verify that the indexes are used."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--group",
+            help="Code of the group, defaults to the group with the most payments.",
+        )
+        parser.add_argument(
+            "--no-analyze",
+            action="store_true",
+            help="Don't execute the queries for the plans. Analyzing is only "
+            "supported on PostgreSQL.",
+        )
+
+    def get_group(self, code: str | None) -> Group:
+        groups = Group.objects.annotate(payment_count=Count("payments"))
+        if code:
+            try:
+                group = groups.get(code=code)
+            except Group.DoesNotExist:
+                raise CommandError(f"Group {code} does not exist")
+            if not group.payment_count:
+                raise CommandError(f"Group {code} has no payments")
+            return group
+        group = groups.order_by("-payment_count").first()
+        if not group or not group.payment_count:
+            raise CommandError("There are no payments, seed the database first")
+        return group
+
+    def get_paths(self, group: Group) -> dict:
+        """Returns callables that run the hot queries of the group and table pages."""
+
+        def get_page(cursor=None):
+            view = PaymentPageMixin()
+            view.request = RequestFactory().get("/", {"before": cursor or ""})
+            return view.get_payments_page(group.payments.all())
+
+        payments, cursor = get_page()
+        position = (payments[-1].created_at, payments[-1].pk)
+        return {
+            "First payments page": get_page,
+            "Next payments page": lambda: get_page(cursor),
+            "Balances": lambda: Entry.objects.balances_by_participant(group),
+            "Table entries": lambda: list(
+                Entry.objects.filter(payment__in=payments).values_list(
+                    "payment", "participant", "amount"
+                )
+            ),
+            "Running balances": lambda: Entry.objects.running_balances(group, payments),
+            "Checkpoint balances": lambda: BalanceCheckpoint.objects.balances(
+                group, position
+            ),
+        }
+
+    def handle(self, *args, **options):
+        group = self.get_group(options["group"])
+        analyze = connection.vendor == "postgresql" and not options["no_analyze"]
+        prefix = connection.ops.explain_query_prefix(
+            **({"analyze": True} if analyze else {})
+        )
+        self.stdout.write(f"Group {group.code}, {group.payments.count()} payments")
+
+        for name, path in self.get_paths(group).items():
+            # The queries are captured with the parameters filled in
+            with CaptureQueriesContext(connection) as context:
+                path()
+            for query in context.captured_queries:
+                self.stdout.write(f"\n== {name}\n{query['sql']}\n")
+                with connection.cursor() as cursor:
+                    cursor.execute(f"{prefix} {query['sql']}")
+                    for row in cursor.fetchall():
+                        self.stdout.write(" ".join(str(column) for column in row))
@@ -0,0 +1,28 @@
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+
+from splitzie.forms import ExpenseImportForm
+from splitzie.models import Group
+
+
+class Command(BaseCommand):
+    help = "Imports the expenses of a group from a CSV or JSON file, see splitzie.importer."
+
+    def add_arguments(self, parser):
+        parser.add_argument("code", help="Code of the group.")
+        parser.add_argument("file", help="Path of the CSV or JSON file.")
+
+    def handle(self, *args, **options):
+        try:
+            group = Group.objects.get(code=options["code"])
+        except Group.DoesNotExist:
+            raise CommandError(f"Group {options['code']!r} does not exist")
+
+        with open(options["file"], "rb") as f:
+            form = ExpenseImportForm(
+                files={"file": File(f, name=options["file"])}, group=group
+            )
+            if not form.is_valid():
+                raise CommandError("\n".join(form.errors["file"]))
+            expenses = form.save()
+        self.stdout.write(f"Imported {len(expenses)} expense(s)")
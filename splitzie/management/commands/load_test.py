@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from splitzie import loadtest
+from splitzie.models import Group
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs the load test scenario on random groups and reports the latencies "
+        "and query counts per endpoint. The scenario adds payments to the groups, "
+        "so only run it on a seeded database, see seed_load."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=100)
+        parser.add_argument(
+            "--groups",
+            type=int,
+            default=100,
+            help="Number of random groups to pick from.",
+        )
+        parser.add_argument(
+            "--steps",
+            nargs="+",
+            choices=loadtest.SCENARIO,
+            default=list(loadtest.SCENARIO),
+        )
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        groups = list(
+            Group.objects.filter(name__startswith="Load test")
+            .order_by("?")
+            .prefetch_related("participants")[: options["groups"]]
+        )
+        if not groups:
+            raise CommandError("There are no load test groups, run seed_load first")
+
+        results = loadtest.run(
+            groups, options["iterations"], options["steps"], options["seed"]
+        )
+        self.stdout.write(
+            f"{'endpoint':<20}{'requests':>9}{'errors':>8}"
+            f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'queries':>9}{'max':>6}"
+        )
+        for r in results:
+            self.stdout.write(
+                f"{r.endpoint:<20}{r.requests:>9}{r.errors:>8}"
+                f"{r.p50 * 1000:>10.1f}{r.p95 * 1000:>10.1f}{r.p99 * 1000:>10.1f}"
+                f"{r.queries:>9.1f}{r.max_queries:>6}"
+            )
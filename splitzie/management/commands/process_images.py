@@ -0,0 +1,84 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from splitzie.models import Expense
+
+# Time after which a claimed image is processed by another worker
+CLAIM_TIMEOUT = datetime.timedelta(minutes=10)
+
+
+class Command(BaseCommand):
+    help = "Downscales and re-encodes the uploaded receipt images and creates the thumbnails."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Process the pending images and exit, instead of polling.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=10,
+            help="Seconds to wait between polls when there are no pending images.",
+        )
+        parser.add_argument("--batch-size", type=int, default=10)
+
+    def handle(self, *args, **options):
+        while True:
+            count = self.process_batch(options["batch_size"])
+            if options["once"] and count < options["batch_size"]:
+                break
+            if count == 0:
+                time.sleep(options["interval"])
+
+    def claim_batch(self, batch_size: int) -> list[Expense]:
+        """Claims pending images, so that other workers skip them.
+
+        Claims of workers that stopped halfway expire after CLAIM_TIMEOUT.
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            # Skip locked rows, so that multiple workers can run concurrently
+            expenses = list(
+                Expense.objects.select_for_update(skip_locked=True, of=("self",))
+                .filter(image_processed_at=None)
+                .exclude(image="")
+                .filter(
+                    Q(image_claimed_at=None)
+                    | Q(image_claimed_at__lt=now - CLAIM_TIMEOUT)
+                )
+                .order_by("payment_ptr")[:batch_size]
+            )
+            Expense.objects.filter(pk__in=[e.pk for e in expenses]).update(
+                image_claimed_at=now
+            )
+        return expenses
+
+    def process_batch(self, batch_size: int) -> int:
+        """Processes the pending images.
+
+        The images are processed after claiming them, without holding locks.
+
+        Returns:
+            The number of images that were attempted.
+        """
+        expenses = self.claim_batch(batch_size)
+        for expense in expenses:
+            try:
+                expense.process_image()
+            except Exception as e:
+                # Keep the original image, instead of retrying forever
+                self.stderr.write(f"Failed to process image {expense.image}: {e!r}")
+                Expense.objects.filter(pk=expense.pk).update(
+                    image_processed_at=timezone.now()
+                )
+
+        if expenses:
+            self.stdout.write(f"Processed {len(expenses)} image(s)")
+        return len(expenses)
@@ -0,0 +1,65 @@
+import decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from splitzie.models import Entry, Group, Participant
+
+
+class Command(BaseCommand):
+    help = (
+        "Verifies the stored participant balances against the entries and repairs them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Only verify the balances, exit with an error when any is incorrect.",
+        )
+
+    def handle(self, *args, **options):
+        incorrect = 0
+        # One transaction per group, to not block payment writes of other
+        # groups for the whole run
+        for group in Group.objects.filter(participants__isnull=False).distinct():
+            incorrect += self.verify_group(group, options["check"])
+
+        if incorrect and options["check"]:
+            raise CommandError(f"{incorrect} incorrect balance(s)")
+        if incorrect:
+            self.stdout.write(f"Repaired {incorrect} balance(s)")
+        else:
+            self.stdout.write("All balances are correct")
+
+    def verify_group(self, group: Group, check: bool) -> int:
+        """Verifies the balances of the group participants and repairs them.
+
+        Returns:
+            The number of incorrect balances.
+        """
+        incorrect = 0
+        with transaction.atomic():
+            # The participants are locked before the entries are summed in a
+            # separate statement, so that the sums include the payments that
+            # held the locks
+            participants = list(
+                Participant.objects.select_for_update()
+                .filter(group=group)
+                .order_by("pk")
+            )
+            sums = Entry.objects.balances_by_participant(group)
+            for p in participants:
+                entries_sum = sums.get(p.pk, decimal.Decimal("0.00"))
+                if p.balance == entries_sum:
+                    continue
+
+                incorrect += 1
+                self.stderr.write(
+                    f"Participant {p.pk} ({p.name}): stored balance {p.balance}, "
+                    f"entries sum {entries_sum}"
+                )
+                if not check:
+                    p.balance = entries_sum
+                    p.save(update_fields=["balance"])
+        return incorrect
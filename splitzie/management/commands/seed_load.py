@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from splitzie import seed
+
+
+class Command(BaseCommand):
+    help = "Seeds the database with generated groups, for load testing."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--groups", type=int, default=1000)
+        parser.add_argument(
+            "--participants",
+            type=int,
+            nargs=2,
+            default=[2, 12],
+            metavar=("MIN", "MAX"),
+            help="Range of the number of participants per group.",
+        )
+        parser.add_argument(
+            "--payments",
+            type=int,
+            nargs=2,
+            default=[10, 500],
+            metavar=("MIN", "MAX"),
+            help="Range of the number of payments per group.",
+        )
+        parser.add_argument(
+            "--emails",
+            type=int,
+            default=3,
+            help="Maximum number of linked e-mails per group.",
+        )
+        parser.add_argument(
+            "--settle-ratio",
+            type=float,
+            default=0.1,
+            help="Fraction of the payments that is a settlement.",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        participants, payments = options["participants"], options["payments"]
+        if not 2 <= participants[0] <= participants[1] <= len(seed.NAMES):
+            raise CommandError(
+                f"The participant range must be between 2 and {len(seed.NAMES)}"
+            )
+        if not 0 <= payments[0] <= payments[1]:
+            raise CommandError("Invalid payment range")
+
+        total = seed.seed(
+            options["groups"],
+            participants,
+            payments,
+            options["emails"],
+            options["settle_ratio"],
+            options["seed"],
+        )
+        self.stdout.write(f"Created {options['groups']} groups with {total} payments")
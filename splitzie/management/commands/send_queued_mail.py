@@ -0,0 +1,122 @@
+import datetime
+import time
+
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from splitzie.mail import make_message
+from splitzie.models import QueuedMail
+
+# Time after which a claimed mail is sent by another worker
+CLAIM_TIMEOUT = datetime.timedelta(minutes=10)
+
+
+class Command(BaseCommand):
+    help = "Sends the queued e-mails, retrying failed ones with exponential backoff."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Send the mails that are due and exit, instead of polling.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=10,
+            help="Seconds to wait between polls when the queue is empty.",
+        )
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument("--max-attempts", type=int, default=5)
+        parser.add_argument(
+            "--backoff",
+            type=float,
+            default=60,
+            help="Seconds to wait before the first retry, doubled for each next one.",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            count = self.send_batch(
+                options["batch_size"], options["max_attempts"], options["backoff"]
+            )
+            if options["once"] and count < options["batch_size"]:
+                break
+            if count == 0:
+                time.sleep(options["interval"])
+
+    def claim_batch(self, batch_size: int, max_attempts: int) -> list[QueuedMail]:
+        """Claims due mails, so that other workers skip them.
+
+        The attempt is counted when claiming. The next attempt is postponed by
+        CLAIM_TIMEOUT, after which the mail is sent again if the worker stopped
+        halfway.
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            # Skip locked rows, so that multiple workers can run concurrently
+            mails = list(
+                QueuedMail.objects.select_for_update(skip_locked=True)
+                .filter(
+                    sent_at=None,
+                    attempts__lt=max_attempts,
+                    next_attempt_at__lte=now,
+                )
+                .order_by("next_attempt_at")[:batch_size]
+            )
+            QueuedMail.objects.filter(pk__in=[m.pk for m in mails]).update(
+                attempts=F("attempts") + 1, next_attempt_at=now + CLAIM_TIMEOUT
+            )
+        for mail in mails:
+            mail.attempts += 1
+        return mails
+
+    def send_batch(self, batch_size: int, max_attempts: int, backoff: float) -> int:
+        """Sends the due mails over a single connection.
+
+        The mails are sent after claiming them, without holding locks, and each
+        mail is marked as sent directly after sending it.
+
+        Returns:
+            The number of mails that were attempted.
+        """
+        mails = self.claim_batch(batch_size, max_attempts)
+        if not mails:
+            return 0
+
+        connection = get_connection()
+        try:
+            connection.open()
+            error = None
+        except Exception as e:
+            error = e
+
+        sent = 0
+        for mail in mails:
+            if error is None:
+                try:
+                    make_message(
+                        mail.subject, mail.body, [mail.to], connection=connection
+                    ).send()
+                except Exception as e:
+                    self.fail(mail, e, backoff)
+                else:
+                    QueuedMail.objects.filter(pk=mail.pk).update(sent_at=timezone.now())
+                    sent += 1
+            else:
+                self.fail(mail, error, backoff)
+        connection.close()
+
+        self.stdout.write(f"Sent {sent} of {len(mails)} mail(s)")
+        return len(mails)
+
+    def fail(self, mail: QueuedMail, error: Exception, backoff: float):
+        QueuedMail.objects.filter(pk=mail.pk).update(
+            next_attempt_at=timezone.now()
+            + datetime.timedelta(seconds=backoff * 2 ** (mail.attempts - 1)),
+            last_error=repr(error),
+        )
+        self.stderr.write(f"Failed to send mail {mail.pk}: {error!r}")
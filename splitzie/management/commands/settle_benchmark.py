@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+
+from splitzie import benchmark
+
+
+class Command(BaseCommand):
+    help = "Times the settle engines on generated balances and reports the number of moves."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes", type=int, nargs="+", default=[4, 8, 16, 32, 64, 128, 200]
+        )
+        parser.add_argument(
+            "--distributions",
+            nargs="+",
+            choices=benchmark.DISTRIBUTIONS,
+            default=list(benchmark.DISTRIBUTIONS),
+        )
+        parser.add_argument(
+            "--engines",
+            nargs="+",
+            choices=benchmark.ENGINES,
+            default=list(benchmark.ENGINES),
+        )
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        results = benchmark.run(
+            options["sizes"],
+            options["distributions"],
+            options["engines"],
+            options["repeat"],
+            options["seed"],
+        )
+        self.stdout.write(
+            f"{'distribution':<18}{'size':>6}  {'engine':<14}"
+            f"{'mean ms':>10}{'max ms':>10}{'moves':>9}{'saved':>9}"
+        )
+        for r in results:
+            self.stdout.write(
+                f"{r.distribution:<18}{r.size:>6}  {r.engine:<14}"
+                f"{r.latency * 1000:>10.3f}{r.max_latency * 1000:>10.3f}"
+                f"{r.moves:>9.1f}{r.saved:>9.1f}"
+            )
@@ -0,0 +1,76 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from splitzie.models import BalanceCheckpoint, Entry, Group, position_q
+
+
+class Command(BaseCommand):
+    help = "Verifies the balance checkpoints against the entries and deletes incorrect ones."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Only verify the checkpoints, exit with an error when any is incorrect.",
+        )
+
+    def handle(self, *args, **options):
+        incorrect = 0
+        groups = (
+            BalanceCheckpoint.objects.values_list("group", flat=True)
+            .distinct()
+            .order_by("group")
+        )
+        # One transaction per group, to not block payment deletions of other
+        # groups for the whole run
+        for group in Group.objects.filter(pk__in=list(groups)):
+            incorrect += self.verify_group(group, options["check"])
+
+        if incorrect and options["check"]:
+            raise CommandError(f"{incorrect} incorrect checkpoint(s)")
+        if incorrect:
+            self.stdout.write(
+                f"Deleted {incorrect} incorrect checkpoint(s) and the later ones"
+            )
+        else:
+            self.stdout.write("All checkpoints are correct")
+
+    def verify_group(self, group: Group, check: bool) -> int:
+        """Verifies the checkpoints of the group and deletes incorrect ones.
+
+        Returns:
+            The number of incorrect checkpoints. When not checking, this is at
+            most 1, because the later checkpoints are deleted too.
+        """
+        incorrect = 0
+        with transaction.atomic():
+            checkpoints = BalanceCheckpoint.objects.select_for_update().filter(
+                group=group
+            )
+            # Group the rows per checkpoint
+            sets = {}
+            for row in checkpoints.order_by("created_at", "payment"):
+                sets.setdefault(row.payment_id, []).append(row)
+
+            for payment, rows in sets.items():
+                position = (rows[0].created_at, payment)
+                expected = Entry.objects.filter(
+                    position_q(position, "lte")
+                ).balances_by_participant(group)
+                actual = {row.participant_id: row.balance for row in rows}
+                if {k: v for k, v in expected.items() if v} == {
+                    k: v for k, v in actual.items() if v
+                }:
+                    continue
+
+                incorrect += 1
+                self.stderr.write(
+                    f"Group {group.pk}: checkpoint at payment {payment} is incorrect"
+                )
+                if not check:
+                    # Later checkpoints are based on this one, so they go too
+                    checkpoints.filter(
+                        position_q(position, "gte", created_at="created_at")
+                    ).delete()
+                    break
+        return incorrect
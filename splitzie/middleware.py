@@ -0,0 +1,144 @@
+import contextlib
+import logging
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+
+class QueryRecorder:
+    """Database execute wrapper that records the statements and their time."""
+
+    def __init__(self):
+        self.time = 0.0
+        # Statements with placeholders, so repeated queries have the same key
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.time += time.perf_counter() - start
+            self.statements[sql] += 1
+
+    @property
+    def count(self) -> int:
+        return self.statements.total()
+
+
+class InstrumentationMiddleware:
+    """Measures the queries, template render time and size of each response.
+
+    The measurements are added as Server-Timing header, except on streaming
+    responses, and requests that exceed SLOW_REQUEST_TIME or
+    SLOW_REQUEST_QUERIES are logged with the most repeated statements. Enabled
+    by the INSTRUMENT_REQUESTS setting.
+    """
+
+    def __init__(self, get_response):
+        if not settings.INSTRUMENT_REQUESTS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        request._render_times = []
+        start = time.perf_counter()
+        with self.record(recorder):
+            response = self.get_response(request)
+
+        if response.streaming:
+            # The headers are sent before the content is generated, so the
+            # measurements are only logged, after the content is consumed
+            if not response.is_async:
+                response.streaming_content = self.stream(
+                    request, response, response.streaming_content, recorder, start
+                )
+            return response
+
+        duration = time.perf_counter() - start
+        render_time = sum(request._render_times)
+        size = len(response.content)
+        response.headers["Server-Timing"] = ", ".join(
+            [
+                f'db;dur={recorder.time * 1000:.1f};desc="{recorder.count} queries"',
+                f"tpl;dur={render_time * 1000:.1f}",
+                f"total;dur={duration * 1000:.1f}",
+                f'size;desc="{size} bytes"',
+            ]
+        )
+        self.log(request, response, recorder, render_time, duration, size)
+        return response
+
+    @staticmethod
+    def record(recorder: QueryRecorder) -> contextlib.ExitStack:
+        """Returns a context that records the queries of all connections."""
+        stack = contextlib.ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(recorder))
+        return stack
+
+    def stream(self, request, response, content, recorder: QueryRecorder, start: float):
+        """Yields the streaming content, recording the queries per chunk."""
+        content = iter(content)
+        size = 0
+        try:
+            while True:
+                with self.record(recorder):
+                    chunk = next(content, None)
+                if chunk is None:
+                    break
+                size += len(chunk)
+                yield chunk
+        finally:
+            duration = time.perf_counter() - start
+            render_time = sum(request._render_times)
+            self.log(request, response, recorder, render_time, duration, size)
+
+    def log(
+        self,
+        request,
+        response,
+        recorder: QueryRecorder,
+        render_time: float,
+        duration: float,
+        size: int,
+    ):
+        view_name = getattr(request.resolver_match, "view_name", None) or "-"
+        message = (
+            "%s %s: %d queries in %.1f ms, render %.1f ms, total %.1f ms, %d bytes"
+        )
+        args = (
+            view_name,
+            response.status_code,
+            recorder.count,
+            recorder.time * 1000,
+            render_time * 1000,
+            duration * 1000,
+            size,
+        )
+        if (
+            duration >= settings.SLOW_REQUEST_TIME
+            or recorder.count >= settings.SLOW_REQUEST_QUERIES
+        ):
+            repeated = [
+                f"\n  {count}x {sql}"
+                for sql, count in recorder.statements.most_common(5)
+                if count > 1
+            ]
+            logger.warning("Slow request " + message + "%s", *args, "".join(repeated))
+        else:
+            logger.debug(message, *args)
+
+    def process_template_response(self, request, response):
+        # Template responses are rendered directly after this hook
+        start = time.perf_counter()
+        response.add_post_render_callback(
+            lambda r: request._render_times.append(time.perf_counter() - start)
+        )
+        return response
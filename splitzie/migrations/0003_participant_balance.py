@@ -0,0 +1,34 @@
+# Generated by Django 5.0 on 2026-10-18 08:20
+
+from decimal import Decimal
+from django.db import migrations, models
+
+
+def populate_balances(apps, schema_editor):
+    Participant = apps.get_model("splitzie", "Participant")
+    for participant in Participant.objects.annotate(
+        entries_sum=models.Sum("entries__amount", default=Decimal("0.00"))
+    ):
+        participant.balance = participant.entries_sum
+        participant.save(update_fields=["balance"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("splitzie", "0002_alter_expense_options_alter_group_options_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="participant",
+            name="balance",
+            field=models.DecimalField(
+                decimal_places=2,
+                default=Decimal("0.00"),
+                max_digits=9,
+                verbose_name="balance",
+            ),
+        ),
+        migrations.RunPython(populate_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.0 on 2026-10-18 08:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("splitzie", "0003_participant_balance"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="group",
+            name="version",
+            field=models.PositiveIntegerField(
+                default=0, editable=False, verbose_name="version"
+            ),
+        ),
+    ]
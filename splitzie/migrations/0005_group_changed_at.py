@@ -0,0 +1,23 @@
+# Generated by Django 5.0 on 2026-10-18 08:26
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("splitzie", "0004_group_version"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="group",
+            name="changed_at",
+            field=models.DateTimeField(
+                default=django.utils.timezone.now,
+                editable=False,
+                verbose_name="changed at",
+            ),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.0 on 2026-10-18 08:38
+
+import splitzie.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("splitzie", "0006_queuedmail"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="expense",
+            name="image_processed_at",
+            field=models.DateTimeField(
+                blank=True, editable=False, null=True, verbose_name="image processed at"
+            ),
+        ),
+        migrations.AddField(
+            model_name="expense",
+            name="thumbnail",
+            field=models.ImageField(
+                blank=True,
+                editable=False,
+                upload_to=splitzie.models.expense_image_path,
+                verbose_name="thumbnail",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="expense",
+            index=models.Index(
+                condition=models.Q(
+                    ("image_processed_at", None), models.Q(("image", ""), _negated=True)
+                ),
+                fields=["payment_ptr"],
+                name="unprocessed_image",
+            ),
+        ),
+    ]
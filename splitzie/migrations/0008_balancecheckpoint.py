@@ -0,0 +1,82 @@
+# Generated by Django 5.0 on 2026-10-18 08:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("splitzie", "0007_expense_thumbnail"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="group",
+            name="payments_since_checkpoint",
+            field=models.PositiveIntegerField(
+                default=0, editable=False, verbose_name="payments since checkpoint"
+            ),
+        ),
+        migrations.CreateModel(
+            name="BalanceCheckpoint",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created_at", models.DateTimeField(verbose_name="created at")),
+                (
+                    "balance",
+                    models.DecimalField(
+                        decimal_places=2, max_digits=9, verbose_name="balance"
+                    ),
+                ),
+                (
+                    "group",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="checkpoints",
+                        to="splitzie.group",
+                    ),
+                ),
+                (
+                    "participant",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="checkpoints",
+                        to="splitzie.participant",
+                    ),
+                ),
+                (
+                    "payment",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="checkpoints",
+                        to="splitzie.payment",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "balance checkpoint",
+                "verbose_name_plural": "balance checkpoints",
+                "indexes": [
+                    models.Index(
+                        fields=["group", "created_at", "payment"],
+                        name="group_checkpoints",
+                    )
+                ],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="balancecheckpoint",
+            constraint=models.UniqueConstraint(
+                models.F("payment"), models.F("participant"), name="unique_checkpoint"
+            ),
+        ),
+    ]
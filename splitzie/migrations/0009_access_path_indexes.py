@@ -0,0 +1,68 @@
+# Generated by Django 5.0 on 2026-10-18 08:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("splitzie", "0008_balancecheckpoint"),
+    ]
+
+    operations = [
+        # Add the replacement indexes before dropping the foreign key indexes
+        migrations.AddIndex(
+            model_name="entry",
+            index=models.Index(
+                fields=["payment", "participant"],
+                include=("amount",),
+                name="payment_entries",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="entry",
+            index=models.Index(
+                fields=["participant"], include=("amount",), name="participant_entries"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="payment",
+            index=models.Index(
+                models.F("group"),
+                models.OrderBy(models.F("created_at"), descending=True),
+                models.OrderBy(models.F("id"), descending=True),
+                name="group_payments",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="entry",
+            name="participant",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="entries",
+                to="splitzie.participant",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="entry",
+            name="payment",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="entries",
+                to="splitzie.payment",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="payment",
+            name="group",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="payments",
+                to="splitzie.group",
+            ),
+        ),
+    ]
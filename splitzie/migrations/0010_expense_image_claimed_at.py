@@ -0,0 +1,20 @@
+# Generated by Django 5.0 on 2026-10-18 08:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("splitzie", "0009_access_path_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="expense",
+            name="image_claimed_at",
+            field=models.DateTimeField(
+                blank=True, editable=False, null=True, verbose_name="image claimed at"
+            ),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0 on 2026-10-18 09:00
+
+from django.db import migrations, models
+
+
+# The settlement label was shortened in the model without a migration. Only the
+# migration state changes, choices don't alter the database.
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("splitzie", "0010_expense_image_claimed_at"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="payment",
+            name="type",
+            field=models.CharField(
+                choices=[("expense", "Expense or income"), ("settle", "Settlement")],
+                max_length=10,
+            ),
+        ),
+    ]
@@ -1,22 +1,38 @@
 from __future__ import annotations
 
+import datetime
 import decimal
 import os.path
 import uuid
+from itertools import groupby
 from secrets import token_urlsafe
 from typing import Iterable
 
 from django.conf import settings
 from django.contrib.auth.models import AbstractBaseUser, AbstractUser
-from django.db import models, transaction
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.db import connection, models, transaction
 from django.db.models.functions import Lower
+from django.db.models.signals import post_delete, pre_delete
+from django.dispatch import receiver
 from django.urls import reverse
-from django.utils import translation
-from django.utils.functional import cached_property
+from django.utils import translation, timezone
+from django.utils.connection import ConnectionProxy
 from django.utils.translation import gettext_lazy as _
 
-from splitzie.mail import send_rendered_mail
-from splitzie.settle import Settler, SettleEntry
+from splitzie import images
+from splitzie.mail import queue_rendered_mail, render_mail
+from splitzie.settle import SettleEntry, Move, PlanCache
+
+plan_cache = PlanCache(
+    settings.SETTLE_PLAN_CACHE_SIZE,
+    (
+        ConnectionProxy(caches, settings.SETTLE_PLAN_SHARED_CACHE)
+        if settings.SETTLE_PLAN_SHARED_CACHE
+        else None
+    ),
+)
 
 
 class Group(models.Model):
@@ -25,6 +41,17 @@ class Group(models.Model):
         _("code"), max_length=150, default=token_urlsafe, unique=True
     )
     created_at = models.DateTimeField(_("created at"), auto_now_add=True)
+    # Incremented on each change that affects the group pages, used for the
+    # cached page fragments and conditional requests
+    version = models.PositiveIntegerField(_("version"), default=0, editable=False)
+    changed_at = models.DateTimeField(
+        _("changed at"), default=timezone.now, editable=False
+    )
+    # A balance checkpoint is written when this reaches
+    # BALANCE_CHECKPOINT_INTERVAL
+    payments_since_checkpoint = models.PositiveIntegerField(
+        _("payments since checkpoint"), default=0, editable=False
+    )
 
     class Meta:
         verbose_name = _("group")
@@ -33,21 +60,139 @@ class Group(models.Model):
     def get_absolute_url(self):
         return reverse("group", kwargs={"code": self.code})
 
-    def get_moves(self):
-        settler = Settler([SettleEntry(p, p.balance) for p in self.participants.all()])
-        moves = settler.get_optimal_brute_force()
-        return moves
+    def lock(self):
+        """Locks the group row until the end of the transaction.
+
+        Payments take this lock before they are saved, so that their
+        creation times are assigned in commit order. Otherwise a payment
+        could commit before a later checkpoint and be left out of the
+        balances.
+        """
+        Group.objects.select_for_update().filter(pk=self.pk).get()
+
+    def bump_version(self, payments: int = 0):
+        """Invalidates the cached page fragments and ETags of this group.
+
+        Args:
+            payments: The number of added payments. A balance checkpoint is
+                written when it's due.
+        """
+        Group.objects.filter(pk=self.pk).update(
+            version=models.F("version") + 1,
+            changed_at=timezone.now(),
+            payments_since_checkpoint=models.F("payments_since_checkpoint") + payments,
+        )
+        self.refresh_from_db(
+            fields=["version", "changed_at", "payments_since_checkpoint"]
+        )
+        if self.payments_since_checkpoint >= settings.BALANCE_CHECKPOINT_INTERVAL:
+            self.write_checkpoint()
+
+    def write_checkpoint(self):
+        """Stores the balances after the latest payment.
+
+        See BalanceCheckpointQuerySet.balances.
+        """
+        payment = self.payments.order_by("-created_at", "-id").first()
+        if payment is not None:
+            position = (payment.created_at, payment.pk)
+            BalanceCheckpoint.objects.bulk_create(
+                [
+                    BalanceCheckpoint(
+                        group=self,
+                        participant_id=pk,
+                        payment=payment,
+                        created_at=payment.created_at,
+                        balance=balance,
+                    )
+                    for pk, balance in BalanceCheckpoint.objects.balances(
+                        self, position
+                    ).items()
+                ],
+                ignore_conflicts=True,
+            )
+        Group.objects.filter(pk=self.pk).update(payments_since_checkpoint=0)
+        self.payments_since_checkpoint = 0
+
+    def get_balances(
+        self, at: datetime.datetime = None
+    ) -> list[tuple[Participant, decimal.Decimal]]:
+        """Returns each participant with the balance computed from the entries.
+
+        Args:
+            at: Returns the balances after the payments created up to this
+                time, instead of the current balances.
+        """
+        balances = BalanceCheckpoint.objects.balances(
+            self, (at, MAX_ID) if at else None
+        )
+        return [
+            (p, balances.get(p.pk, decimal.Decimal("0.00")))
+            for p in self.participants.all()
+        ]
+
+    def get_moves_anytime(
+        self, balances: list[tuple[Participant, decimal.Decimal]] = None
+    ) -> tuple[list[Move], bool]:
+        """Returns the best moves found so far, and whether the search finished.
+
+        When the search takes too long, it continues in the background, see
+        PlanCache.get_anytime.
+        """
+        if balances is None:
+            balances = self.get_balances()
+        moves, final = plan_cache.get_anytime(
+            [SettleEntry(p.pk, b) for p, b in balances],
+            settings.SETTLE_BACKGROUND_TIME_LIMIT,
+        )
+        return Group._participant_moves(balances, moves), final
+
+    @staticmethod
+    def _participant_moves(balances, moves: list[Move]) -> list[Move]:
+        """Replaces the participant IDs in the moves with the participants."""
+        participants = {p.pk: p for p, b in balances}
+        return [
+            Move(participants[m.source], participants[m.target], m.amount)
+            for m in moves
+        ]
 
     def send_mail(
         self, email_template_name: str, subject_template_name: str, context: dict = None
     ):
-        """Sends a (separate) email to each linked e-mail address.
+        """Queues a (separate) email to each linked e-mail address.
+
+        The templates are rendered once per language. The link to remove the
+        e-mail address differs per address, so it is rendered for a
+        placeholder and substituted afterwards.
 
         See:
             LinkedEmail.send_mail
         """
-        for linked_email in self.emails.all():
-            linked_email.send_mail(email_template_name, subject_template_name, context)
+        if context is None:
+            context = {}
+
+        def get_delete_url(pk: int) -> str:
+            return reverse("email-delete", kwargs={"code": self.code, "pk": pk})
+
+        mails = []
+        linked_emails = sorted(self.emails.all(), key=lambda e: e.language)
+        for language, emails in groupby(linked_emails, key=lambda e: e.language):
+            with translation.override(language):
+                subject, message = render_mail(
+                    email_template_name,
+                    subject_template_name,
+                    {**context, "linked_email": LinkedEmail(pk=0, group=self)},
+                )
+                placeholder_url = get_delete_url(0)
+                mails += [
+                    QueuedMail(
+                        to=e.email,
+                        subject=subject,
+                        body=message.replace(placeholder_url, get_delete_url(e.pk)),
+                    )
+                    for e in emails
+                ]
+        QueuedMail.objects.bulk_create(mails)
 
     def __str__(self):
         return self.name
@@ -66,14 +211,13 @@ class LinkedEmail(models.Model):
     def send_mail(
         self, email_template_name: str, subject_template_name: str, context: dict = None
     ):
-        """Sends a mail in the correct language."""
+        """Queues a mail in the correct language."""
         if context is None:
             context = {}
 
         context["linked_email"] = self
         with translation.override(self.language):
-            # It's probably better (for testing) to return a list of e-mails instead of directly sending them
-            send_rendered_mail(
+            queue_rendered_mail(
                 email_template_name, subject_template_name, [self.email], context
             )
 
@@ -86,6 +230,12 @@ class Participant(models.Model):
         Group, on_delete=models.CASCADE, related_name="participants"
     )
     name = models.CharField(_("name"), max_length=150)
+    # Sum of the entry amounts, kept up to date on entry writes.
+    #
+    # Use the rebuild_balances command to verify or repair it.
+    balance = models.DecimalField(
+        _("balance"), max_digits=9, decimal_places=2, default=decimal.Decimal("0.00")
+    )
 
     class Meta:
         ordering = ("name",)
@@ -95,13 +245,12 @@ class Participant(models.Model):
     def __str__(self):
         return self.name
 
-    @cached_property
-    def balance(self):
-        return Entry.objects.filter(participant=self).balance()
-
 
 class Payment(models.Model):
-    group = models.ForeignKey(Group, on_delete=models.PROTECT, related_name="payments")
+    # Indexed by group_payments
+    group = models.ForeignKey(
+        Group, on_delete=models.PROTECT, related_name="payments", db_index=False
+    )
     created_at = models.DateTimeField(_("created at"), auto_now_add=True)
 
     type = models.CharField(
@@ -116,9 +265,31 @@ class Payment(models.Model):
         ordering = ("-created_at",)
         verbose_name = _("payment")
         verbose_name_plural = _("payments")
+        indexes = [
+            # The payments of a group in the order of the pages
+            models.Index(
+                "group",
+                models.F("created_at").desc(),
+                models.F("id").desc(),
+                name="group_payments",
+            ),
+        ]
 
     def save_with_entries(self, entries: Iterable[Entry]):
         """Cleans the entries and atomically saves this payment with entries."""
+        entries = Payment.clean_entries(entries)
+        amounts = Payment.participant_amounts(self.group_id, entries)
+
+        with transaction.atomic():
+            self.group.lock()
+            self.save()
+            Entry.objects.bulk_create(entries)
+            Payment.add_to_balances(amounts)
+            self.group.bump_version(payments=1)
+
+    @staticmethod
+    def clean_entries(entries: Iterable[Entry]) -> list[Entry]:
+        """Filters null entries and checks that the entries of a payment sum to 0."""
         # Filter null entries
         entries = [e for e in entries if e.amount != 0]
 
@@ -129,16 +300,35 @@ class Payment(models.Model):
         # Sanity check: entries must sum to 0
         if sum(e.amount for e in entries) != 0:
             raise ValueError("Sum of entries is not 0!")
+        return entries
 
-        # Sanity check: participants must be part of the same group
-        for entry in entries:
-            if entry.participant.group != self.group:
-                raise ValueError("Participant is not part of this group")
+    @staticmethod
+    def participant_amounts(group_id, entries: list[Entry]) -> dict:
+        """Sums the entry amounts per participant.
 
-        with transaction.atomic():
-            self.save()
-            for e in entries:
-                e.save()
+        Raises ValueError when a participant is not part of the group.
+        """
+        amounts = {}
+        for e in entries:
+            amounts[e.participant_id] = amounts.get(e.participant_id, 0) + e.amount
+
+        # Sanity check: participants must be part of the same group
+        if Participant.objects.filter(pk__in=amounts, group=group_id).count() != len(
+            amounts
+        ):
+            raise ValueError("Participant is not part of this group")
+        return amounts
+
+    @staticmethod
+    def add_to_balances(amounts: dict):
+        """Adds the amounts to the participant balances in a single query."""
+        Participant.objects.filter(pk__in=amounts).update(
+            balance=models.F("balance")
+            + models.Case(
+                *(models.When(pk=pk, then=amount) for pk, amount in amounts.items()),
+                output_field=models.DecimalField(),
+            )
+        )
 
     def get_transfer(self) -> tuple[Participant, Participant, decimal.Decimal]:
         """Get transfer details.
@@ -146,6 +336,8 @@ class Payment(models.Model):
         If this payment contains exactly 2 entries, it's a money transfer
         with a source and target. This method returns the source participant,
         target participant and amount.
+
+        Uses the prefetched entries when available.
         """
         entries = list(self.entries.all())
         if len(entries) != 2:
@@ -156,13 +348,6 @@ class Payment(models.Model):
         else:
             return entries[1].participant, entries[0].participant, entries[1].amount
 
-    def entries_for_all(self):
-        """Returns for each group participant the payment entry, or None when there's no entry."""
-        for participant in self.group.participants.all():
-            yield participant, Entry.objects.filter(
-                payment=self, participant=participant
-            ).first()
-
 
 def expense_image_path(instance, filename):
     """Generates a random file path."""
@@ -182,10 +367,28 @@ class Expense(Payment):
     )
     description = models.CharField(_("description"), max_length=150)
     image = models.ImageField(upload_to=expense_image_path, blank=True)
+    # Created by process_image, which also replaces the uploaded image
+    thumbnail = models.ImageField(
+        _("thumbnail"), upload_to=expense_image_path, blank=True, editable=False
+    )
+    image_processed_at = models.DateTimeField(
+        _("image processed at"), null=True, blank=True, editable=False
+    )
+    # Set by the process_images worker that is processing the image
+    image_claimed_at = models.DateTimeField(
+        _("image claimed at"), null=True, blank=True, editable=False
+    )
 
     class Meta:
         verbose_name = _("expense")
         verbose_name_plural = _("expenses")
+        indexes = [
+            models.Index(
+                fields=["payment_ptr"],
+                condition=models.Q(image_processed_at=None) & ~models.Q(image=""),
+                name="unprocessed_image",
+            )
+        ]
 
     def abs_amount(self):
         return abs(self.amount)
@@ -196,6 +399,113 @@ class Expense(Payment):
     def get_absolute_url(self):
         return reverse("expense", kwargs={"code": self.group.code, "pk": self.pk})
 
+    @staticmethod
+    def bulk_save_with_entries(
+        group: Group, expenses: list[tuple[Expense, Iterable[Entry]]]
+    ):
+        """Atomically saves many expenses of the group, with their entries.
+
+        The same checks are done as in save_with_entries, but the rows are
+        inserted in bulk. When the created_at of an expense is set, it's
+        kept instead of the current time.
+        """
+        entries = []
+        for expense, expense_entries in expenses:
+            if expense.group_id != group.pk:
+                raise ValueError("Expense is not part of this group")
+            entries += Payment.clean_entries(expense_entries)
+        amounts = Payment.participant_amounts(group.pk, entries)
+
+        with transaction.atomic():
+            group.lock()
+            # bulk_create doesn't support multi-table inheritance, so the
+            # payment and expense rows are inserted separately
+            payments = Payment.objects.bulk_create(
+                Payment(group=group, type=expense.type) for expense, _ in expenses
+            )
+            dated = []
+            for (expense, _entries), payment in zip(expenses, payments):
+                if expense.created_at is not None:
+                    payment.created_at = expense.created_at
+                    dated.append(payment)
+                expense.payment_ptr = payment
+                expense.id = payment.id
+                expense.created_at = payment.created_at
+            Payment.objects.bulk_update(dated, ["created_at"], batch_size=500)
+            Expense.insert_expense_rows([expense for expense, _ in expenses])
+
+            Entry.objects.bulk_create(entries, batch_size=1000)
+            Payment.add_to_balances(amounts)
+            if dated:
+                # Checkpoints after the earliest imported payment are outdated
+                earliest = min(payment.created_at for payment in dated)
+                BalanceCheckpoint.objects.filter(
+                    group=group, created_at__gte=earliest
+                ).delete()
+            group.bump_version(payments=len(expenses))
+
+    @staticmethod
+    def insert_expense_rows(expenses: list[Expense]):
+        """Inserts the expense table rows, for expenses with saved payment rows.
+
+        bulk_create doesn't support multi-table inheritance, so the rows are
+        inserted with a plain INSERT statement.
+        """
+        fields = Expense._meta.local_concrete_fields
+        qn = connection.ops.quote_name
+        sql = "INSERT INTO {} ({}) VALUES ({})".format(
+            qn(Expense._meta.db_table),
+            ", ".join(qn(f.column) for f in fields),
+            ", ".join(["%s"] * len(fields)),
+        )
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                sql,
+                [
+                    [
+                        f.get_db_prep_save(getattr(e, f.attname), connection)
+                        for f in fields
+                    ]
+                    for e in expenses
+                ],
+            )
+
+    def process_image(self):
+        """Replaces the image with a processed copy and creates the thumbnail.
+
+        The image is processed outside of a transaction. The row is only
+        updated when the image wasn't replaced in the meantime, and the
+        original file is deleted after the commit.
+
+        See splitzie.images.process.
+        """
+        original = self.image.name
+        with self.image.open("rb"):
+            image, thumbnail = images.process(self.image)
+        # The upload path keeps only the extension of the name
+        extension = settings.EXPENSE_IMAGE_FORMAT.lower()
+        self.image.save(f"receipt.{extension}", ContentFile(image), save=False)
+        self.thumbnail.save(
+            f"thumbnail.{extension}", ContentFile(thumbnail), save=False
+        )
+        self.image_processed_at = timezone.now()
+        storage = self.image.storage
+
+        with transaction.atomic():
+            updated = Expense.objects.filter(pk=self.pk, image=original).update(
+                image=self.image.name,
+                thumbnail=self.thumbnail.name,
+                image_processed_at=self.image_processed_at,
+            )
+            if not updated:
+                # The expense was deleted or has another image
+                storage.delete(self.image.name)
+                storage.delete(self.thumbnail.name)
+                return
+            # The pages link to the new files
+            self.group.bump_version()
+            transaction.on_commit(lambda: storage.delete(original))
+
     def get_division(self) -> list[tuple[Entry, decimal.Decimal]]:
         """Returns the division as how it was entered in the form originally."""
         sign = -1 if self.is_expense() else 1
@@ -209,12 +519,42 @@ class Expense(Payment):
         ]
 
 
+def quantize_cents(amount: decimal.Decimal) -> decimal.Decimal:
+    """Quantizes to 2 decimal places, raising when this would lose precision."""
+    return amount.quantize(
+        decimal.Decimal("1.00"), context=decimal.Context(traps=[decimal.Inexact])
+    )
+
+
+# Upper bound of the IDs, to include all payments created at a certain time
+MAX_ID = 2**63 - 1
+
+
+def position_q(
+    position: tuple[datetime.datetime, int],
+    lookup: str,
+    created_at: str = "payment__created_at",
+    pk: str = "payment",
+) -> models.Q:
+    """Filters on the position of a payment in the (created_at, ID) order.
+
+    Args:
+        position: The position to compare with.
+        lookup: One of "lt", "lte", "gt" and "gte".
+        created_at: Name of the payment creation time field.
+        pk: Name of the payment ID field.
+    """
+    return models.Q(**{f"{created_at}__{lookup[:2]}": position[0]}) | models.Q(
+        **{created_at: position[0], f"{pk}__{lookup}": position[1]}
+    )
+
+
 class EntryQuerySet(models.QuerySet):
     def balance(self):
-        return self.aggregate(models.Sum("amount", default=decimal.Decimal("0.00")))[
-            "amount__sum"
-        ].quantize(
-            decimal.Decimal("1.00"), context=decimal.Context(traps=[decimal.Inexact])
+        return quantize_cents(
+            self.aggregate(models.Sum("amount", default=decimal.Decimal("0.00")))[
+                "amount__sum"
+            ]
         )
         # return (
         #     self.aggregate(balance=models.Sum("amount"))["balance"]
@@ -223,15 +563,97 @@ class EntryQuerySet(models.QuerySet):
         #     decimal.Decimal(10) ** -2, context=decimal.Context(traps=[decimal.Inexact])
         # )
 
+    def balances_by_participant(self, group: Group) -> dict[int, decimal.Decimal]:
+        """Returns the balances of the group participants using a single query.
+
+        Returns:
+            A dictionary with participant IDs for keys and balances as
+            values. Participants without entries are omitted.
+        """
+        rows = (
+            self.filter(participant__group=group)
+            .values("participant")
+            .annotate(balance=models.Sum("amount"))
+            .values_list("participant", "balance")
+        )
+        return {pk: quantize_cents(balance) for pk, balance in rows}
+
+    def running_balances(
+        self, group: Group, payments: list[Payment]
+    ) -> dict[tuple[int, int], tuple[decimal.Decimal, decimal.Decimal]]:
+        """Returns the entries of the payments with the balance after each entry.
+
+        The balances start from the latest checkpoint before the payments, and
+        the later entries are summed with a window function. The window is
+        computed in a subquery, so that the payments are only selected
+        afterwards. This takes 2 queries.
+
+        Returns:
+            A dictionary with (payment ID, participant ID) keys and (amount,
+            balance) values.
+        """
+        if not payments:
+            return {}
+        oldest = min((p.created_at, p.pk) for p in payments)
+        newest = max((p.created_at, p.pk) for p in payments)
+        checkpoint = BalanceCheckpoint.objects.latest_rows(group, oldest, "lt")
+        start = {row.participant_id: row.balance for row in checkpoint}
+
+        entries = self.filter(participant__group=group).filter(
+            position_q(newest, "lte")
+        )
+        if checkpoint:
+            entries = entries.filter(
+                position_q((checkpoint[0].created_at, checkpoint[0].payment_id), "gt")
+            )
+        sql, params = (
+            entries.annotate(
+                running=models.Window(
+                    models.Sum("amount"),
+                    partition_by=models.F("participant"),
+                    order_by=[
+                        models.F("payment__created_at").asc(),
+                        models.F("payment").asc(),
+                    ],
+                )
+            )
+            .values("payment", "participant", "amount", "running")
+            .query.sql_with_params()
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT * FROM ({}) windowed WHERE {} IN ({})".format(
+                    sql,
+                    connection.ops.quote_name("payment_id"),
+                    ", ".join(["%s"] * len(payments)),
+                ),
+                [*params, *(p.pk for p in payments)],
+            )
+            rows = cursor.fetchall()
+
+        # The plain cursor doesn't convert the values, SQLite returns floats
+        amount_field = Entry._meta.get_field("amount")
+        balance_field = Participant._meta.get_field("balance")
+        return {
+            (payment, participant): (
+                amount_field.to_python(amount),
+                quantize_cents(
+                    start.get(participant, 0) + balance_field.to_python(running)
+                ),
+            )
+            for payment, participant, amount, running in rows
+        }
+
 
 class Entry(models.Model):
     """Each payment modifies the balance of two or more group participants."""
 
+    # The foreign keys are indexed by the indexes below
     payment = models.ForeignKey(
-        Payment, on_delete=models.CASCADE, related_name="entries"
+        Payment, on_delete=models.CASCADE, related_name="entries", db_index=False
     )
     participant = models.ForeignKey(
-        Participant, on_delete=models.PROTECT, related_name="entries"
+        Participant, on_delete=models.PROTECT, related_name="entries", db_index=False
     )
     amount = models.DecimalField(_("amount"), max_digits=7, decimal_places=2)
 
@@ -239,3 +661,159 @@ class Entry(models.Model):
 
     class Meta:
         verbose_name_plural = "entries"
+        indexes = [
+            # Covering indexes, the amounts are read from the index. The
+            # included column is only supported on PostgreSQL.
+            models.Index(
+                fields=["payment", "participant"],
+                include=["amount"],
+                name="payment_entries",
+            ),
+            models.Index(
+                fields=["participant"],
+                include=["amount"],
+                name="participant_entries",
+            ),
+        ]
+
+
+class BalanceCheckpointQuerySet(models.QuerySet):
+    def latest_rows(
+        self,
+        group: Group,
+        position: tuple[datetime.datetime, int] = None,
+        lookup: str = "lte",
+    ) -> list[BalanceCheckpoint]:
+        """Returns the rows of the latest checkpoint of the group.
+
+        Args:
+            position: Only consider the checkpoints before ("lt") or at or
+                before ("lte") this (created_at, ID) position of a payment.
+        """
+        checkpoints = self.filter(group=group)
+        if position:
+            checkpoints = checkpoints.filter(
+                position_q(position, lookup, created_at="created_at")
+            )
+        latest = checkpoints.order_by("-created_at", "-payment").values("payment")
+        return list(self.filter(group=group, payment=models.Subquery(latest[:1])))
+
+    def balances(
+        self, group: Group, up_to: tuple[datetime.datetime, int] = None
+    ) -> dict[int, decimal.Decimal]:
+        """Returns the balances of the group participants after a payment.
+
+        The balances are computed from the latest checkpoint at or before the
+        payment, plus the entries of the payments after the checkpoint. This
+        takes 2 queries.
+
+        Args:
+            up_to: The (created_at, ID) position of the payment, or None for
+                the current balances.
+
+        Returns:
+            A dictionary with participant IDs for keys and balances as
+            values. Participants without entries are omitted.
+        """
+        rows = self.latest_rows(group, up_to)
+        balances = {row.participant_id: row.balance for row in rows}
+
+        entries = Entry.objects.all()
+        if rows:
+            entries = entries.filter(
+                position_q((rows[0].created_at, rows[0].payment_id), "gt")
+            )
+        if up_to:
+            entries = entries.filter(position_q(up_to, "lte"))
+        for pk, amount in entries.balances_by_participant(group).items():
+            balances[pk] = balances.get(pk, 0) + amount
+        return balances
+
+
+class BalanceCheckpoint(models.Model):
+    """Balance of a participant after a payment.
+
+    The checkpoints of a group are written by Group.write_checkpoint, for
+    all participants at once. Use the verify_checkpoints command to verify
+    or repair them.
+    """
+
+    group = models.ForeignKey(
+        Group, on_delete=models.CASCADE, related_name="checkpoints"
+    )
+    participant = models.ForeignKey(
+        Participant, on_delete=models.CASCADE, related_name="checkpoints"
+    )
+    payment = models.ForeignKey(
+        Payment, on_delete=models.CASCADE, related_name="checkpoints"
+    )
+    # Creation time of the payment
+    created_at = models.DateTimeField(_("created at"))
+    balance = models.DecimalField(_("balance"), max_digits=9, decimal_places=2)
+
+    objects = BalanceCheckpointQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = _("balance checkpoint")
+        verbose_name_plural = _("balance checkpoints")
+        constraints = [
+            models.UniqueConstraint("payment", "participant", name="unique_checkpoint")
+        ]
+        indexes = [
+            models.Index(
+                fields=["group", "created_at", "payment"], name="group_checkpoints"
+            )
+        ]
+
+
+@receiver(pre_delete, sender=Payment)
+def payment_deleted(sender, instance: Payment, **kwargs):
+    """Deletes the balance checkpoints that include the payment."""
+    BalanceCheckpoint.objects.filter(group=instance.group_id).filter(
+        position_q(
+            (instance.created_at, instance.pk),
+            "gte",
+            created_at="created_at",
+        )
+    ).delete()
+
+
+@receiver(post_delete, sender=Entry)
+def entry_deleted(sender, instance: Entry, **kwargs):
+    """Reverts the entry amount on the participant balance and bumps the group version.
+
+    This is also called for entries that are deleted by cascade.
+    """
+    Participant.objects.filter(pk=instance.participant_id).update(
+        balance=models.F("balance") - instance.amount
+    )
+    Group.objects.filter(participants=instance.participant_id).update(
+        version=models.F("version") + 1, changed_at=timezone.now()
+    )
+
+
+class QueuedMail(models.Model):
+    """An outgoing e-mail, sent by the send_queued_mail command."""
+
+    to = models.EmailField(_("to"))
+    subject = models.TextField(_("subject"))
+    body = models.TextField(_("body"))
+    created_at = models.DateTimeField(_("created at"), auto_now_add=True)
+    attempts = models.PositiveIntegerField(_("attempts"), default=0)
+    next_attempt_at = models.DateTimeField(_("next attempt at"), default=timezone.now)
+    sent_at = models.DateTimeField(_("sent at"), null=True, blank=True)
+    last_error = models.TextField(_("last error"), blank=True)
+
+    class Meta:
+        verbose_name = _("queued mail")
+        verbose_name_plural = _("queued mails")
+        indexes = [
+            models.Index(
+                fields=["next_attempt_at"],
+                condition=models.Q(sent_at=None),
+                name="unsent_mail",
+            )
+        ]
+
+    def __str__(self):
+        return self.subject
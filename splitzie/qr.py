@@ -0,0 +1,38 @@
+"""QR code images of the group URLs.
+
+The images only depend on the URL, so they are memoized per process.
+"""
+
+import functools
+import hashlib
+import io
+
+import qrcode
+import qrcode.image.svg
+
+FORMATS = {
+    "png": "image/png",
+    "svg": "image/svg+xml",
+}
+
+
+@functools.lru_cache(maxsize=256)
+def make_qr(data: str, format: str) -> bytes:
+    """Returns the encoded QR code image of the data."""
+    if format == "svg":
+        qr = qrcode.QRCode(image_factory=qrcode.image.svg.SvgPathImage, box_size=10)
+        qr.add_data(data)
+        qr.make(fit=True)
+        return qr.make_image().to_string()
+
+    qr = qrcode.QRCode(box_size=5, border=5)
+    qr.add_data(data)
+    qr.make()
+    buffered = io.BytesIO()
+    qr.make_image().save(buffered)
+    return buffered.getvalue()
+
+
+def qr_etag(data: str, format: str) -> str:
+    """Returns the ETag of the image, without generating it."""
+    return hashlib.md5(f"{format}:{data}".encode(), usedforsecurity=False).hexdigest()
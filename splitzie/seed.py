@@ -0,0 +1,284 @@
+"""Generation of realistic groups for load testing.
+
+Run it using the seed_load command. The rows are inserted in bulk, a chunk of
+groups at a time, with the participant balances and balance checkpoints that
+the pages would have written.
+"""
+
+import datetime
+import random
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from splitzie.models import (
+    BalanceCheckpoint,
+    Entry,
+    Expense,
+    Group,
+    LinkedEmail,
+    Participant,
+    Payment,
+)
+
+NAMES = [
+    "Alice",
+    "Bob",
+    "Carol",
+    "Dave",
+    "Eve",
+    "Frank",
+    "Grace",
+    "Heidi",
+    "Ivan",
+    "Judy",
+    "Mallory",
+    "Niaj",
+    "Olivia",
+    "Peggy",
+    "Rupert",
+    "Sybil",
+    "Trent",
+    "Victor",
+    "Walter",
+    "Yolanda",
+]
+
+DESCRIPTIONS = [
+    "Groceries",
+    "Dinner",
+    "Drinks",
+    "Train tickets",
+    "Fuel",
+    "Rent",
+    "Cinema",
+    "Hotel",
+    "Lunch",
+    "Museum",
+]
+
+BATCH_SIZE = 1000
+
+# Oldest group, relative to now
+HISTORY = datetime.timedelta(days=365)
+
+
+def _divide(total: int, n: int, rng: random.Random) -> list[int]:
+    """Divides the cents equally, with the remainder going to random shares."""
+    shares = [total // n] * n
+    for i in rng.sample(range(n), total % n):
+        shares[i] += 1
+    return shares
+
+
+class GroupHistory:
+    """The generated rows of a group, linked by object instead of ID."""
+
+    def __init__(
+        self,
+        index: int,
+        participants: int,
+        payments: int,
+        emails: int,
+        settle_ratio: float,
+        rng: random.Random,
+    ):
+        now = timezone.now()
+        created_at = now - rng.random() * HISTORY
+        self.group = Group(
+            name=f"Load test {index}", created_at=created_at, changed_at=now
+        )
+        self.participants = [
+            Participant(group=self.group, name=name)
+            for name in rng.sample(NAMES, participants)
+        ]
+        self.emails = [
+            LinkedEmail(
+                group=self.group,
+                email=f"{p.name.lower()}.{index}@example.com",
+                language=rng.choice(settings.LANGUAGES)[0],
+            )
+            for p in rng.sample(self.participants, min(emails, participants))
+        ]
+        # Lists of (payment, entries), oldest first
+        self.payments = []
+        self.checkpoints = []
+
+        # The participants are unsaved, so they are referred to by index
+        balances = [0] * participants
+        # Participants with entries, like in Group.write_checkpoint
+        seen = set()
+        times = sorted(
+            created_at + rng.random() * (now - created_at) for _ in range(payments)
+        )
+        for created_at in times:
+            debtor = min(range(participants), key=balances.__getitem__)
+            creditor = max(range(participants), key=balances.__getitem__)
+            if balances[creditor] > 0 and rng.random() < settle_ratio:
+                # Settle (part of) the largest debt
+                amount = min(balances[creditor], -balances[debtor])
+                amount = rng.choice([amount, rng.randint(1, amount)])
+                payment = Payment(
+                    group=self.group, type="settle", created_at=created_at
+                )
+                cents = {debtor: amount, creditor: -amount}
+            else:
+                payment, cents = self.make_expense(created_at, rng)
+            entries = []
+            for i, amount in cents.items():
+                if amount:
+                    balances[i] += amount
+                    seen.add(i)
+                    entries.append(
+                        Entry(
+                            payment=payment,
+                            participant=self.participants[i],
+                            amount=Decimal(amount).scaleb(-2),
+                        )
+                    )
+            self.payments.append((payment, entries))
+            if len(self.payments) % settings.BALANCE_CHECKPOINT_INTERVAL == 0:
+                self.checkpoints += [
+                    BalanceCheckpoint(
+                        group=self.group,
+                        participant=self.participants[i],
+                        payment=payment,
+                        created_at=created_at,
+                        balance=Decimal(balances[i]).scaleb(-2),
+                    )
+                    for i in sorted(seen)
+                ]
+
+        for participant, balance in zip(self.participants, balances):
+            participant.balance = Decimal(balance).scaleb(-2)
+        self.group.payments_since_checkpoint = (
+            len(self.payments) % settings.BALANCE_CHECKPOINT_INTERVAL
+        )
+
+    def make_expense(
+        self, created_at: datetime.datetime, rng: random.Random
+    ) -> tuple[Expense, dict[int, int]]:
+        """Returns an expense or income, divided over some participants.
+
+        Returns:
+            The expense and the entry amounts in cents, by participant index.
+        """
+        n = len(self.participants)
+        payer = rng.randrange(n)
+        others = [i for i in range(n) if i != payer]
+        division = rng.sample(others, rng.randint(1, len(others)))
+        if rng.random() < 0.7:
+            division.append(payer)
+        total = rng.randint(100, 20000)
+        # Expenses have a negative amount, income a positive amount
+        sign = 1 if rng.random() < 0.05 else -1
+        expense = Expense(
+            group=self.group,
+            type="expense",
+            created_at=created_at,
+            amount=Decimal(sign * total).scaleb(-2),
+            payer=self.participants[payer],
+            description=rng.choice(DESCRIPTIONS),
+        )
+        cents = {i: 0 for i in range(n)}
+        for i, share in zip(division, _divide(total, len(division), rng)):
+            cents[i] += sign * share
+        cents[payer] -= sign * total
+        return expense, cents
+
+
+def seed_chunk(histories: list[GroupHistory]):
+    """Inserts the generated rows of the groups in bulk.
+
+    The creation times are set on insert, so the generated ones are restored
+    afterwards, like in Expense.bulk_save_with_entries.
+    """
+    groups = [h.group for h in histories]
+    payments = [p for h in histories for p, _ in h.payments]
+    group_times = [g.created_at for g in groups]
+    payment_times = [p.created_at for p in payments]
+    with transaction.atomic():
+        Group.objects.bulk_create(groups, batch_size=BATCH_SIZE)
+        for group, created_at in zip(groups, group_times):
+            group.created_at = created_at
+        Group.objects.bulk_update(groups, ["created_at"], batch_size=BATCH_SIZE)
+        Participant.objects.bulk_create(
+            [p for h in histories for p in h.participants], batch_size=BATCH_SIZE
+        )
+        LinkedEmail.objects.bulk_create(
+            [e for h in histories for e in h.emails], batch_size=BATCH_SIZE
+        )
+
+        # bulk_create doesn't support multi-table inheritance, so the payment
+        # and expense rows are inserted separately
+        rows = [
+            (
+                payment
+                if type(payment) is Payment
+                else Payment(group=payment.group, type=payment.type)
+            )
+            for payment in payments
+        ]
+        Payment.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+        for row, created_at in zip(rows, payment_times):
+            row.created_at = created_at
+        Payment.objects.bulk_update(rows, ["created_at"], batch_size=BATCH_SIZE)
+        expenses = []
+        for payment, row in zip(payments, rows):
+            if isinstance(payment, Expense):
+                payment.id = payment.payment_ptr_id = row.id
+                # The payer was unsaved when it was assigned
+                payment.payer_id = payment.payer.pk
+                expenses.append(payment)
+        for i in range(0, len(expenses), BATCH_SIZE):
+            Expense.insert_expense_rows(expenses[i : i + BATCH_SIZE])
+
+        Entry.objects.bulk_create(
+            [e for h in histories for _, entries in h.payments for e in entries],
+            batch_size=BATCH_SIZE,
+        )
+        BalanceCheckpoint.objects.bulk_create(
+            [c for h in histories for c in h.checkpoints], batch_size=BATCH_SIZE
+        )
+
+
+def seed(
+    groups: int,
+    participants: tuple[int, int],
+    payments: tuple[int, int],
+    emails: int,
+    settle_ratio: float,
+    seed: int = 0,
+    chunk_size: int = 100,
+):
+    """Generates and inserts the groups, a chunk at a time.
+
+    Args:
+        participants: Minimum and maximum number of participants per group.
+        payments: Minimum and maximum number of payments per group.
+        emails: Maximum number of linked e-mails per group.
+        settle_ratio: Fraction of the payments that is a settlement, when
+            there's a debt.
+
+    Returns:
+        The total number of payments.
+    """
+    rng = random.Random(seed)
+    total = 0
+    for start in range(0, groups, chunk_size):
+        histories = [
+            GroupHistory(
+                i,
+                rng.randint(*participants),
+                rng.randint(*payments),
+                rng.randint(0, emails),
+                settle_ratio,
+                rng,
+            )
+            for i in range(start, min(start + chunk_size, groups))
+        ]
+        seed_chunk(histories)
+        total += sum(len(h.payments) for h in histories)
+    return total
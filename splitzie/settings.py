@@ -33,6 +33,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "splitzie.middleware.InstrumentationMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.locale.LocaleMiddleware",
@@ -76,6 +77,53 @@ DATABASES = {
     }
 }
 
+# Cache for rendered page fragments, which are invalidated using Group.version.
+#
+# The default local memory cache is per process. Set GS_CACHE_BACKEND to "file"
+# or "db" to share the cache between processes. For "db", first create the
+# table using the createcachetable command.
+if os.environ.get("GS_CACHE_BACKEND") == "file":
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": os.environ.get("GS_CACHE_LOCATION", "/var/tmp/splitzie"),
+        }
+    }
+elif os.environ.get("GS_CACHE_BACKEND") == "db":
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+            "LOCATION": os.environ.get("GS_CACHE_LOCATION", "splitzie_cache"),
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+
+# Settle plans are memoized per process. Set GS_SETTLE_PLAN_CACHE to a cache
+# alias (e.g. "default") to also share them between processes.
+SETTLE_PLAN_CACHE_SIZE = 256
+SETTLE_PLAN_SHARED_CACHE = os.environ.get("GS_SETTLE_PLAN_CACHE")
+# Seconds the settle page may search for a better plan in the background,
+# showing the quick plan in the meantime
+SETTLE_BACKGROUND_TIME_LIMIT = float(
+    os.environ.get("GS_SETTLE_BACKGROUND_TIME_LIMIT", "2.0")
+)
+
+# Number of payments after which the group balances are stored in a
+# checkpoint, which bounds the number of entries to sum for a balance
+BALANCE_CHECKPOINT_INTERVAL = 100
+
+# Adds a Server-Timing header with the query count and times to each response,
+# and logs requests that take at least SLOW_REQUEST_TIME seconds or
+# SLOW_REQUEST_QUERIES queries, with the most repeated statements
+INSTRUMENT_REQUESTS = "GS_INSTRUMENT_REQUESTS" in os.environ
+SLOW_REQUEST_TIME = float(os.environ.get("GS_SLOW_REQUEST_TIME", "0.5"))
+SLOW_REQUEST_QUERIES = int(os.environ.get("GS_SLOW_REQUEST_QUERIES", "50"))
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -116,6 +164,13 @@ STATIC_URL = os.environ.get("GS_STATIC_URL", "static/")
 MEDIA_ROOT = os.environ.get("GS_MEDIA_ROOT", "media/")
 MEDIA_URL = os.environ.get("GS_MEDIA_URL", "media/")
 
+# Uploaded receipt images are downscaled and re-encoded by the process_images
+# command, which also creates the thumbnails
+EXPENSE_IMAGE_MAX_SIZE = 1600
+EXPENSE_IMAGE_THUMBNAIL_SIZE = 400
+EXPENSE_IMAGE_FORMAT = os.environ.get("GS_EXPENSE_IMAGE_FORMAT", "WEBP")
+EXPENSE_IMAGE_QUALITY = 80
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
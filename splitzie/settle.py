@@ -1,7 +1,11 @@
-from collections import namedtuple
-from decimal import Decimal
+import hashlib
+import threading
+import time
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal, Context, Inexact
 from itertools import permutations
-from typing import Hashable, NamedTuple, Any, Generator, Iterable, Iterator
+from typing import Hashable, NamedTuple, Any, Generator, Iterable, Iterator, Callable
 
 
 class SettleEntry(NamedTuple):
@@ -15,9 +19,26 @@ class Move(NamedTuple):
     amount: Decimal
 
 
+def to_cents(amount: Decimal) -> int:
+    """Converts a euro amount to cents, raising when it has more than 2 decimals."""
+    return int(amount.scaleb(2).to_integral_exact(context=Context(traps=[Inexact])))
+
+
+def from_cents(cents: int) -> Decimal:
+    """Converts cents to a euro amount with 2 decimals."""
+    return Decimal(cents).scaleb(-2)
+
+
+class _Timeout(Exception):
+    """Raised internally when the time budget of a search is exhausted."""
+
+
 class Settler:
     """Settle a list of balances.
 
+    Internally, the balances are stored as integer cents, which is a lot
+    faster than Decimal. They are converted back to Decimal for the moves.
+
     Sources:
 
     - https://en.wikipedia.org/wiki/Bin_packing_problem
@@ -25,6 +46,8 @@ class Settler:
     - https://stackoverflow.com/q/877728/2373688
     """
 
+    STRATEGIES = ("greedy", "largest_first", "exact_pairs", "subsets")
+
     creditors: list[SettleEntry]
     debtors: list[SettleEntry]
 
@@ -37,15 +60,110 @@ class Settler:
         """
         if sum(e.balance for e in entries) != 0:
             raise ValueError("Balances must sum to 0")
+        entries = [SettleEntry(e.id, to_cents(e.balance)) for e in entries]
         self.creditors = [e for e in entries if e.balance > 0]
         self.debtors = [e for e in entries if e.balance < 0]
 
+    @staticmethod
+    def _from_cents(moves: list[Move]) -> list[Move]:
+        return [Move(m.source, m.target, from_cents(m.amount)) for m in moves]
+
+    @staticmethod
+    def _exact_pairs(entries: list[SettleEntry]) -> tuple[list[list], list]:
+        """Pairs opposite balances using an index over the amounts.
+
+        Returns:
+            The pairs, and the remaining entries.
+        """
+        creditors = {}
+        for e in entries:
+            if e.balance > 0:
+                creditors.setdefault(e.balance, []).append(e)
+        pairs, rest = [], []
+        for e in entries:
+            if e.balance < 0:
+                if creditors.get(-e.balance):
+                    pairs.append([creditors[-e.balance].pop(), e])
+                else:
+                    rest.append(e)
+        rest = [e for c in creditors.values() for e in c] + rest
+        return pairs, rest
+
+    @staticmethod
+    def _zero_sum_triples(entries: list[SettleEntry]) -> tuple[list[list], list]:
+        """Greedily takes out zero-sum subsets of 3 balances.
+
+        For each pair of balances, the third balance is looked up in an index
+        over the amounts, so this is quadratic in the number of entries.
+
+        Returns:
+            The triples, and the remaining entries.
+        """
+        index = {}
+        for i, e in enumerate(entries):
+            index.setdefault(e.balance, []).append(i)
+        used = set()
+        triples = []
+        for i in range(len(entries)):
+            for j in range(i + 1, len(entries)):
+                if i in used:
+                    break
+                if j in used:
+                    continue
+                target = -(entries[i].balance + entries[j].balance)
+                k = next(
+                    (k for k in index.get(target, ()) if k > j and k not in used), None
+                )
+                if k is not None:
+                    triples.append([entries[i], entries[j], entries[k]])
+                    used.update((i, j, k))
+        return triples, [e for i, e in enumerate(entries) if i not in used]
+
+    @staticmethod
+    def _settle_groups(groups: list[list]) -> list[Move]:
+        """Settles each zero-sum group of entries, largest balances first."""
+        moves = []
+        for group in groups:
+            group = sorted(group, key=lambda e: abs(e.balance), reverse=True)
+            moves += Settler.get_moves(
+                [e for e in group if e.balance > 0],
+                [e for e in group if e.balance < 0],
+            )
+        return moves
+
+    def get_heuristic(self, strategy: str = "subsets") -> list[Move]:
+        """Returns a quick solution using one of the STRATEGIES.
+
+        - greedy: get_moves in input order.
+        - largest_first: get_moves on the balances sorted by size.
+        - exact_pairs: opposite balances are paired first, the remainder is
+          settled largest-first.
+        - subsets: like exact_pairs, but also takes out zero-sum triples
+          before settling the remainder.
+        """
+        if strategy not in Settler.STRATEGIES:
+            raise ValueError(f"Unknown strategy {strategy!r}")
+        entries = self.creditors + self.debtors
+        if strategy == "greedy":
+            moves = Settler.get_moves(self.creditors, self.debtors)
+        elif strategy == "largest_first":
+            moves = Settler._settle_groups([entries])
+        else:
+            groups, rest = Settler._exact_pairs(entries)
+            if strategy == "subsets":
+                triples, rest = Settler._zero_sum_triples(rest)
+                groups += triples
+            moves = Settler._settle_groups(groups + [rest])
+        return Settler._from_cents(moves)
+
     @staticmethod
     def get_moves(creditors, debtors) -> list[Move]:
         """Runs the algorithm and returns the moves.
 
         The order of entries determines how optimal the solution is. Different
         orderings may give more optimal solutions.
+
+        Works on both Decimal and integer balances.
         """
         if len(debtors) == 0:
             # In this case, creditors will also be empty.
@@ -85,7 +203,7 @@ class Settler:
                 limit, we don't find the optimal but just return *a* solution.
         """
         if len(self.creditors) + len(self.debtors) > limit:
-            return Settler.get_moves(self.creditors, self.debtors)
+            return Settler._from_cents(Settler.get_moves(self.creditors, self.debtors))
 
         optimal = None
 
@@ -95,4 +213,254 @@ class Settler:
                 if optimal is None or len(moves) < len(optimal):
                     optimal = moves
 
-        return optimal
+        return Settler._from_cents(optimal)
+
+    def get_optimal(
+        self,
+        time_limit: float = 0.05,
+        limit: int = 24,
+        on_improvement: Callable[[list[Move]], None] = None,
+    ) -> list[Move]:
+        """Returns a solution with the minimal number of moves.
+
+        Each subset of balances that sums to 0 can be settled on its own
+        with one move less than its size. The optimal solution is therefore
+        found by partitioning the balances into as many zero-sum subsets as
+        possible. This is done with a depth-first search over bitmasks of
+        the remaining balances, memoizing the visited masks.
+
+        With a time limit of 0, this returns the quick solution that pairs
+        opposite balances and settles the rest largest-first.
+
+        Args:
+            time_limit: Time budget for the search in seconds. When it runs
+                out, the best solution found so far is returned.
+            limit: When more than this number of balances remain after
+                pairing opposite balances, the search is skipped and the
+                subsets heuristic is used instead.
+            on_improvement: Called with the moves each time the search
+                finds a better solution.
+
+        Afterwards, the timed_out attribute tells whether the time budget
+        ran out, in which case the solution may not be optimal.
+        """
+        deadline = time.monotonic() + time_limit
+        self.timed_out = False
+
+        # Opposite balances are always settled with a single move
+        pairs, rest = Settler._exact_pairs(self.creditors + self.debtors)
+        if len(rest) > limit:
+            return self.get_heuristic()
+
+        def get_moves(partition: list[int]) -> list[Move]:
+            groups = pairs + [
+                [e for i, e in enumerate(rest) if mask >> i & 1] for mask in partition
+            ]
+            return Settler._from_cents(Settler._settle_groups(groups))
+
+        partition = Settler._partition(
+            [e.balance for e in rest],
+            deadline,
+            on_improvement and (lambda p: on_improvement(get_moves(p))),
+        )
+        # Also set when the search finished just after the deadline
+        self.timed_out = time.monotonic() > deadline
+        return get_moves(partition)
+
+    @staticmethod
+    def _partition(
+        balances: list,
+        deadline: float,
+        on_improvement: Callable[[list[int]], None] = None,
+    ) -> list[int]:
+        """Partitions the balances into as many zero-sum subsets as possible.
+
+        Args:
+            on_improvement: Called with each better partition that is found.
+
+        Returns:
+            The subsets as bitmasks over the balances. When the deadline
+            passes, the best partition found so far is returned.
+        """
+        n = len(balances)
+        if n == 0:
+            return []
+        positive = sum(1 << i for i, b in enumerate(balances) if b > 0)
+        negative = sum(1 << i for i, b in enumerate(balances) if b < 0)
+
+        best = [(1 << n) - 1]
+        # Remaining mask -> largest number of subsets with which it was reached
+        seen = {}
+
+        def zero_sum_subsets(remaining: int) -> list[int]:
+            """Finds the zero-sum subsets containing the lowest remaining balance.
+
+            Uses a meet-in-the-middle on the subset sums of both halves of
+            the other remaining balances.
+            """
+            if time.monotonic() > deadline:
+                raise _Timeout
+            first = (remaining & -remaining).bit_length() - 1
+            others = [i for i in range(n) if remaining >> i & 1 and i != first]
+            half = len(others) // 2
+
+            def sums(indices):
+                result = [(0, 0)]
+                for i in indices:
+                    result += [(m | 1 << i, s + balances[i]) for m, s in result]
+                return result
+
+            left = {}
+            for m, s in sums(others[:half]):
+                left.setdefault(s, []).append(m)
+            subsets = []
+            for m, s in sums(others[half:]):
+                for lm in left.get(-balances[first] - s, ()):
+                    subsets.append(1 << first | lm | m)
+            # Small subsets first, to quickly find partitions with many subsets
+            subsets.sort(key=int.bit_count)
+            return subsets
+
+        def search(remaining: int, partition: list[int]):
+            nonlocal best
+            if remaining == 0:
+                if len(partition) > len(best):
+                    best = partition
+                    if on_improvement:
+                        on_improvement(best)
+                return
+            # Each subset contains at least one creditor and one debtor
+            bound = len(partition) + min(
+                (remaining & positive).bit_count(), (remaining & negative).bit_count()
+            )
+            if bound <= len(best) or seen.get(remaining, -1) >= len(partition):
+                return
+            seen[remaining] = len(partition)
+            for subset in zero_sum_subsets(remaining):
+                search(remaining & ~subset, partition + [subset])
+
+        try:
+            search((1 << n) - 1, [])
+        except _Timeout:
+            pass
+        return best
+
+
+class PlanCache:
+    """Memoizes optimal settle plans by the balances.
+
+    Plans are kept in a bounded in-process LRU cache. Optionally, a shared
+    cache (with the get and set methods of a Django cache) is used as a
+    second tier, so that processes can reuse each other's plans.
+
+    Plans can also be searched for in a background thread, see get_anytime.
+    """
+
+    def __init__(self, maxsize: int = 256, shared=None):
+        self.maxsize = maxsize
+        self.shared = shared
+        self._plans = OrderedDict()
+        # Best plans so far of the running background searches
+        self._progress = {}
+        self._lock = threading.Lock()
+        self._executor = None
+
+    @staticmethod
+    def key(entries: list[SettleEntry]) -> str:
+        """Returns a hash of the balances, independent of their order."""
+        canonical = sorted(
+            (str(e.id), to_cents(e.balance)) for e in entries if e.balance != 0
+        )
+        return "settle-plan-" + hashlib.sha256(repr(canonical).encode()).hexdigest()
+
+    def _get(self, key: str) -> list[Move] | None:
+        with self._lock:
+            plan = self._plans.get(key)
+            if plan is not None:
+                self._plans.move_to_end(key)
+                return plan
+        if self.shared is not None:
+            plan = self.shared.get(key)
+            if plan is not None:
+                self._put(key, plan, shared=False)
+        return plan
+
+    def _put(self, key: str, plan: list[Move], shared: bool = True):
+        with self._lock:
+            self._plans[key] = plan
+            if len(self._plans) > self.maxsize:
+                self._plans.popitem(last=False)
+        if shared and self.shared is not None:
+            self.shared.set(key, plan)
+
+    def get_optimal(self, entries: list[SettleEntry], **kwargs) -> list[Move]:
+        """Returns the cached plan, or computes it using Settler.get_optimal.
+
+        The entry IDs must be hashable and unambiguous as string, e.g.
+        primary keys.
+        """
+        key = PlanCache.key(entries)
+        plan = self._get(key)
+        if plan is None:
+            plan = Settler(entries).get_optimal(**kwargs)
+            self._put(key, plan)
+        return list(plan)
+
+    def get_anytime(
+        self,
+        entries: list[SettleEntry],
+        time_limit: float,
+        limit: int = 32,
+        sync_time_limit: float = 0.05,
+    ) -> tuple[list[Move], bool]:
+        """Returns a plan at once, searching in the background when it takes too long.
+
+        When the plan is not cached, it's first searched for within
+        sync_time_limit, which suffices for nearly all groups. Only when
+        that runs out, a background search is started (if not already
+        running) with the given time budget. Until it finishes, the best
+        plan found so far is returned. Call again to get an improved plan.
+
+        Returns:
+            The moves, and whether the search has finished.
+        """
+        key = PlanCache.key(entries)
+        plan = self._get(key)
+        if plan is not None:
+            return list(plan), True
+
+        with self._lock:
+            progress = self._progress.get(key)
+        if progress is not None:
+            return list(progress), False
+
+        settler = Settler(entries)
+        plan = settler.get_optimal(sync_time_limit, limit)
+        if not settler.timed_out:
+            self._put(key, plan)
+            return list(plan), True
+
+        with self._lock:
+            # Another request may have started the search in the meantime
+            if key not in self._progress:
+                self._progress[key] = plan
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=1)
+                self._executor.submit(self._search, key, entries, time_limit, limit)
+            plan = self._progress[key]
+        return list(plan), False
+
+    def _search(self, key: str, entries: list[SettleEntry], time_limit, limit):
+        def on_improvement(moves: list[Move]):
+            with self._lock:
+                # The search may start worse than the synchronous plan
+                if len(moves) < len(self._progress[key]):
+                    self._progress[key] = moves
+
+        try:
+            # The budget starts when the search starts, not when it is queued
+            plan = Settler(entries).get_optimal(time_limit, limit, on_improvement)
+            self._put(key, plan)
+        finally:
+            with self._lock:
+                del self._progress[key]
@@ -0,0 +1,1125 @@
+import csv
+import datetime
+import io
+import json
+import os
+import random
+import tempfile
+import time
+from unittest import mock
+from decimal import Decimal
+
+from django.contrib import admin
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command, CommandError
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils import timezone, translation
+from PIL import Image
+
+from splitzie import benchmark
+from splitzie.admin import ExpenseAdmin, GroupAdmin
+from splitzie.forms import SettleForm
+from splitzie.models import (
+    BalanceCheckpoint,
+    Group,
+    Participant,
+    Payment,
+    Entry,
+    Expense,
+    LinkedEmail,
+    QueuedMail,
+)
+from splitzie.settle import Settler, SettleEntry, PlanCache, to_cents, from_cents
+from splitzie.views import PaymentPageMixin
+
+
+def random_entries(n: int, seed: int = 0) -> list[SettleEntry]:
+    """Generates n random balances that sum to 0."""
+    rng = random.Random(seed)
+    cents = [rng.randint(-5000, 5000) for _ in range(n - 1)]
+    cents.append(-sum(cents))
+    return [SettleEntry(i, Decimal(c) / 100) for i, c in enumerate(cents)]
+
+
+class SettlerTestCase(SimpleTestCase):
+    def assertSettles(self, entries: list[SettleEntry], moves):
+        """Asserts that applying the moves brings all balances to 0."""
+        balances = {e.id: e.balance for e in entries}
+        for move in moves:
+            self.assertGreater(move.amount, 0)
+            balances[move.source] += move.amount
+            balances[move.target] -= move.amount
+        self.assertTrue(all(b == 0 for b in balances.values()))
+
+    def test_empty(self):
+        self.assertEqual(Settler([]).get_optimal(), [])
+        self.assertEqual(Settler([SettleEntry(1, Decimal("0.00"))]).get_optimal(), [])
+
+    def test_optimal_matches_brute_force(self):
+        rng = random.Random(1)
+        for _ in range(100):
+            n = rng.randint(2, 7)
+            # Few distinct amounts, so that there are zero-sum subsets
+            cents = [
+                rng.choice([-300, -200, -100, 100, 200, 500]) for _ in range(n - 1)
+            ]
+            cents.append(-sum(cents))
+            entries = [SettleEntry(i, Decimal(c) / 100) for i, c in enumerate(cents)]
+            settler = Settler(entries)
+            moves = settler.get_optimal()
+            self.assertSettles(entries, moves)
+            self.assertEqual(len(moves), len(settler.get_optimal_brute_force()))
+
+    def test_optimal_pairs_opposites(self):
+        entries = [
+            SettleEntry("a", Decimal("10.00")),
+            SettleEntry("b", Decimal("-3.00")),
+            SettleEntry("c", Decimal("-10.00")),
+            SettleEntry("d", Decimal("3.00")),
+        ]
+        moves = Settler(entries).get_optimal()
+        self.assertSettles(entries, moves)
+        self.assertEqual(len(moves), 2)
+
+    def test_heuristics(self):
+        entries = [
+            SettleEntry("a", Decimal("10.00")),
+            SettleEntry("b", Decimal("5.00")),
+            SettleEntry("c", Decimal("-3.00")),
+            SettleEntry("d", Decimal("-2.00")),
+            SettleEntry("e", Decimal("-10.00")),
+        ]
+        counts = {}
+        for strategy in Settler.STRATEGIES:
+            moves = Settler(entries).get_heuristic(strategy)
+            self.assertSettles(entries, moves)
+            counts[strategy] = len(moves)
+        self.assertEqual(
+            counts, {"greedy": 4, "largest_first": 3, "exact_pairs": 3, "subsets": 3}
+        )
+        for seed in range(20):
+            entries = random_entries(40, seed=seed)
+            self.assertSettles(entries, Settler(entries).get_heuristic("subsets"))
+        with self.assertRaises(ValueError):
+            Settler(entries).get_heuristic("random")
+
+    def test_optimal_large_group(self):
+        # 5 shuffled subsets of 4 balances that sum to 0. A full dynamic
+        # program over the subsets confirms that there's no finer partition.
+        rng = random.Random(0)
+        cents = []
+        for _ in range(5):
+            subset = [rng.randint(-5000, 5000) for _ in range(3)]
+            cents += [*subset, -sum(subset)]
+        rng.shuffle(cents)
+        entries = [SettleEntry(i, Decimal(c) / 100) for i, c in enumerate(cents)]
+        settler = Settler(entries)
+        # The time limit is only a safeguard, the search finishes well within
+        moves = settler.get_optimal(time_limit=10)
+        self.assertFalse(settler.timed_out)
+        self.assertSettles(entries, moves)
+        self.assertEqual(len(moves), 15)
+
+    def test_optimal_time_limit(self):
+        # Without any time the initial solution is returned
+        entries = random_entries(20, seed=2)
+        moves = Settler(entries).get_optimal(time_limit=0)
+        self.assertSettles(entries, moves)
+        self.assertLessEqual(len(moves), len(entries) - 1)
+
+    def test_cents_identical_to_decimal(self):
+        # Property: the integer cents core gives exactly the Decimal results
+        rng = random.Random(3)
+        for _ in range(200):
+            n = rng.randint(2, 12)
+            cents = [rng.randint(-20000, 20000) for _ in range(n - 1)]
+            cents.append(-sum(cents))
+            balances = [Decimal(c) / 100 for c in cents]
+            self.assertEqual([to_cents(b) for b in balances], cents)
+            self.assertEqual([from_cents(c) for c in cents], balances)
+
+            entries = [SettleEntry(i, b) for i, b in enumerate(balances)]
+            settler = Settler(entries)
+            self.assertEqual(
+                settler.get_optimal_brute_force(limit=0),
+                Settler.get_moves(
+                    [e for e in entries if e.balance > 0],
+                    [e for e in entries if e.balance < 0],
+                ),
+            )
+            deadline = time.monotonic() + 1
+            self.assertEqual(
+                Settler._partition(cents, deadline),
+                Settler._partition(balances, deadline),
+            )
+
+    def test_benchmark(self):
+        rng = random.Random(0)
+        for distribution in benchmark.DISTRIBUTIONS:
+            for n in (4, 5, 33):
+                entries = benchmark.generate(distribution, n, rng)
+                self.assertEqual(len(entries), n)
+                self.assertEqual(sum(e.balance for e in entries), 0)
+                self.assertNotIn(0, [e.balance for e in entries])
+
+        results = benchmark.run([4, 6], ["uniform"], list(benchmark.ENGINES), repeat=2)
+        self.assertEqual(len(results), 2 * len(benchmark.ENGINES))
+
+    def test_plan_cache(self):
+        plan_cache = PlanCache(maxsize=2)
+        entries = random_entries(6)
+        with mock.patch.object(
+            Settler, "get_optimal", autospec=True, side_effect=Settler.get_optimal
+        ) as get_optimal:
+            moves = plan_cache.get_optimal(entries)
+            self.assertSettles(entries, moves)
+            # Order of the balances doesn't matter
+            self.assertEqual(plan_cache.get_optimal(entries[::-1]), moves)
+            self.assertEqual(get_optimal.call_count, 1)
+
+            # Least recently used plan is evicted
+            plan_cache.get_optimal(random_entries(6, seed=1))
+            plan_cache.get_optimal(random_entries(6, seed=2))
+            plan_cache.get_optimal(entries)
+            self.assertEqual(get_optimal.call_count, 4)
+
+    def test_plan_cache_shared(self):
+        shared = {}
+        shared_cache = mock.Mock(get=shared.get, set=shared.__setitem__)
+        entries = random_entries(6)
+        moves = PlanCache(shared=shared_cache).get_optimal(entries)
+        with mock.patch.object(Settler, "get_optimal") as get_optimal:
+            self.assertEqual(PlanCache(shared=shared_cache).get_optimal(entries), moves)
+        get_optimal.assert_not_called()
+
+    def test_plan_cache_anytime(self):
+        plan_cache = PlanCache()
+        # Small groups are solved at once
+        entries = random_entries(4)
+        moves, final = plan_cache.get_anytime(entries, time_limit=0.1)
+        self.assertTrue(final)
+        self.assertSettles(entries, moves)
+
+        # Without synchronous time, the search runs in the background
+        entries = random_entries(12)
+        moves, final = plan_cache.get_anytime(
+            entries, time_limit=0.1, sync_time_limit=0
+        )
+        self.assertFalse(final)
+        self.assertSettles(entries, moves)
+
+        # Poll until the background search has finished
+        deadline = time.monotonic() + 5
+        while not final and time.monotonic() < deadline:
+            time.sleep(0.01)
+            improved, final = plan_cache.get_anytime(
+                entries, time_limit=0.1, sync_time_limit=0
+            )
+        self.assertTrue(final)
+        self.assertSettles(entries, improved)
+        self.assertLessEqual(len(improved), len(moves))
+        self.assertEqual(plan_cache.get_optimal(entries), improved)
+
+
+class BalanceTestCase(TestCase):
+    def setUp(self):
+        self.group = Group.objects.create()
+        self.alice = Participant.objects.create(group=self.group, name="Alice")
+        self.bob = Participant.objects.create(group=self.group, name="Bob")
+
+    def settle(self, amount: Decimal) -> Payment:
+        payment = Payment(group=self.group, type="settle")
+        payment.save_with_entries(
+            [
+                Entry(payment=payment, participant=self.alice, amount=amount),
+                Entry(payment=payment, participant=self.bob, amount=-amount),
+            ]
+        )
+        return payment
+
+    def test_save_with_entries(self):
+        self.settle(Decimal("12.50"))
+        self.settle(Decimal("2.25"))
+        self.alice.refresh_from_db()
+        self.bob.refresh_from_db()
+        self.assertEqual(self.alice.balance, Decimal("14.75"))
+        self.assertEqual(self.bob.balance, Decimal("-14.75"))
+
+    def test_save_with_entries_queries(self):
+        for n in (3, 30):
+            participants = Participant.objects.bulk_create(
+                Participant(group=self.group, name=f"P{i}") for i in range(n)
+            )
+            expense = Expense(
+                group=self.group,
+                type="expense",
+                amount=Decimal(f"-{n}.00"),
+                payer=self.alice,
+                description="Dinner",
+            )
+            entries = [
+                Entry(payment=expense, participant=p, amount=Decimal("1.00"))
+                for p in participants
+            ]
+            entries.append(
+                Entry(payment=expense, participant=self.alice, amount=Decimal(-n))
+            )
+            # Validation, savepoint, group lock, payment (2 tables), entries,
+            # balances, group version and its refresh, release savepoint
+            with self.assertNumQueries(10):
+                expense.save_with_entries(entries)
+            self.assertEqual(expense.entries.count(), n + 1)
+            participants[0].refresh_from_db()
+            self.assertEqual(participants[0].balance, Decimal("1.00"))
+        self.alice.refresh_from_db()
+        self.assertEqual(self.alice.balance, Decimal("-33.00"))
+
+    def test_save_with_entries_other_group(self):
+        other = Participant.objects.create(group=Group.objects.create(), name="Eve")
+        payment = Payment(group=self.group, type="settle")
+        with self.assertRaises(ValueError):
+            payment.save_with_entries(
+                [
+                    Entry(payment=payment, participant=self.alice, amount=Decimal(1)),
+                    Entry(payment=payment, participant=other, amount=Decimal(-1)),
+                ]
+            )
+        self.assertIsNone(payment.pk)
+        other.refresh_from_db()
+        self.assertEqual(other.balance, 0)
+
+    def test_balances_by_participant(self):
+        self.settle(Decimal("12.50"))
+        carol = Participant.objects.create(group=self.group, name="Carol")
+        with self.assertNumQueries(1):
+            balances = Entry.objects.balances_by_participant(self.group)
+        self.assertEqual(
+            balances, {self.alice.pk: Decimal("12.50"), self.bob.pk: Decimal("-12.50")}
+        )
+        self.assertEqual(
+            self.group.get_balances(),
+            [
+                (self.alice, Decimal("12.50")),
+                (self.bob, Decimal("-12.50")),
+                (carol, Decimal("0.00")),
+            ],
+        )
+
+    def test_cascade_delete(self):
+        self.settle(Decimal("12.50"))
+        self.settle(Decimal("2.25")).delete()
+        self.alice.refresh_from_db()
+        self.assertEqual(self.alice.balance, Decimal("12.50"))
+
+    def test_rebuild_balances(self):
+        self.settle(Decimal("12.50"))
+        call_command("rebuild_balances", "--check", stdout=io.StringIO())
+        Participant.objects.filter(pk=self.alice.pk).update(balance=0)
+        with self.assertRaises(CommandError):
+            call_command(
+                "rebuild_balances",
+                "--check",
+                stdout=io.StringIO(),
+                stderr=io.StringIO(),
+            )
+        call_command("rebuild_balances", stdout=io.StringIO(), stderr=io.StringIO())
+        self.alice.refresh_from_db()
+        self.assertEqual(self.alice.balance, Decimal("12.50"))
+
+    @override_settings(BALANCE_CHECKPOINT_INTERVAL=3)
+    def test_checkpoints(self):
+        times = []
+        for i in range(8):
+            with mock.patch(
+                "django.utils.timezone.now",
+                return_value=datetime.datetime(2024, 1, i + 1, tzinfo=datetime.UTC),
+            ):
+                self.settle(Decimal(i + 1))
+            times.append(datetime.datetime(2024, 1, i + 1, 12, tzinfo=datetime.UTC))
+        self.assertEqual(
+            list(
+                BalanceCheckpoint.objects.filter(participant=self.alice).values_list(
+                    "balance", flat=True
+                )
+            ),
+            [Decimal("6.00"), Decimal("21.00")],
+        )
+
+        # Balances after each day, compared with the sum of all entries
+        for day in times:
+            expected = Entry.objects.filter(
+                payment__created_at__lte=day
+            ).balances_by_participant(self.group)
+            with self.assertNumQueries(3):
+                balances = self.group.get_balances(at=day)
+            self.assertEqual(balances[0], (self.alice, expected[self.alice.pk]))
+        self.assertEqual(
+            self.group.get_balances(),
+            [(self.alice, Decimal("36.00")), (self.bob, Decimal("-36.00"))],
+        )
+
+        # Deleting a payment removes the checkpoints that include it
+        Payment.objects.filter(created_at__date="2024-01-05").delete()
+        self.assertEqual(BalanceCheckpoint.objects.count(), 2)
+        self.assertEqual(self.group.get_balances()[0], (self.alice, Decimal("31.00")))
+
+    @override_settings(BALANCE_CHECKPOINT_INTERVAL=1)
+    def test_checkpoint_race(self):
+        # Another payment commits, with a checkpoint, while this payment waits
+        # for the group lock
+        lock = Group.lock
+        concurrent = []
+
+        def lock_after_concurrent_payment(group):
+            if not concurrent:
+                concurrent.append(None)
+                concurrent[0] = self.settle(Decimal("2.00"))
+            lock(group)
+
+        with mock.patch.object(
+            Group, "lock", autospec=True, side_effect=lock_after_concurrent_payment
+        ):
+            payment = self.settle(Decimal("1.00"))
+        # The creation time is assigned under the lock, so after the checkpoint
+        self.assertGreater(
+            (payment.created_at, payment.pk),
+            (concurrent[0].created_at, concurrent[0].pk),
+        )
+        self.assertEqual(self.group.get_balances()[0], (self.alice, Decimal("3.00")))
+        self.assertEqual(
+            self.group.get_balances(at=payment.created_at)[0],
+            (self.alice, Decimal("3.00")),
+        )
+
+    @override_settings(BALANCE_CHECKPOINT_INTERVAL=2)
+    def test_verify_checkpoints(self):
+        for amount in range(1, 6):
+            self.settle(Decimal(amount))
+        call_command("verify_checkpoints", "--check", stdout=io.StringIO())
+        BalanceCheckpoint.objects.filter(participant=self.alice).update(balance=1)
+        with self.assertRaises(CommandError):
+            call_command(
+                "verify_checkpoints",
+                "--check",
+                stdout=io.StringIO(),
+                stderr=io.StringIO(),
+            )
+        call_command("verify_checkpoints", stdout=io.StringIO(), stderr=io.StringIO())
+        self.assertFalse(BalanceCheckpoint.objects.exists())
+        self.assertEqual(self.group.get_balances()[0], (self.alice, Decimal("15.00")))
+
+
+class GroupViewTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.group = Group.objects.create()
+        self.alice = Participant.objects.create(group=self.group, name="Alice")
+        self.bob = Participant.objects.create(group=self.group, name="Bob")
+
+    def add_payments(self, n: int):
+        for _ in range(n):
+            expense = Expense(
+                group=self.group,
+                type="expense",
+                amount=Decimal("-10.00"),
+                payer=self.alice,
+                description="Groceries",
+            )
+            expense.save_with_entries(
+                [
+                    Entry(
+                        payment=expense, participant=self.alice, amount=Decimal("-5.00")
+                    ),
+                    Entry(
+                        payment=expense, participant=self.bob, amount=Decimal("5.00")
+                    ),
+                ]
+            )
+            payment = Payment(group=self.group, type="settle")
+            payment.save_with_entries(
+                [
+                    Entry(
+                        payment=payment, participant=self.bob, amount=Decimal("-5.00")
+                    ),
+                    Entry(
+                        payment=payment, participant=self.alice, amount=Decimal("5.00")
+                    ),
+                ]
+            )
+
+    def test_group_view_queries(self):
+        url = self.group.get_absolute_url()
+        for n in (1, 10):
+            self.add_payments(n)
+            with self.assertNumQueries(7):
+                response = self.client.get(url)
+            self.assertContains(response, "Groceries")
+
+    def test_table_view_queries(self):
+        url = reverse("group-table", kwargs={"code": self.group.code})
+        for n in (1, 10):
+            self.add_payments(n)
+            with self.assertNumQueries(6):
+                response = self.client.get(url)
+        totals = response.context["totals"]()
+        self.assertEqual(totals, [Decimal("0.00"), Decimal("0.00")])
+        self.assertEqual(len(response.context["rows"]()), 22)
+
+    @mock.patch.object(PaymentPageMixin, "page_size", 3)
+    def test_pagination(self):
+        self.add_payments(4)
+        expected = list(self.group.payments.order_by("-created_at", "-id"))
+
+        for name in ("group", "group-table"):
+            url = reverse(name, kwargs={"code": self.group.code})
+            response = self.client.get(url)
+            pages = [response.context]
+            while pages[-1]["next_cursor"]():
+                response = self.client.get(url, {"before": pages[-1]["next_cursor"]()})
+                pages.append(response.context)
+            if name == "group":
+                payments = [p for page in pages for p in page["payments"]()]
+            else:
+                rows = [row for page in pages for row in page["rows"]()]
+                payments = [payment for payment, cells in rows]
+                # Each running total is the next (older) one plus the entry amount
+                totals = [[total for amount, total in cells] for payment, cells in rows]
+                before = [
+                    [total - (amount or 0) for amount, total in cells]
+                    for payment, cells in rows
+                ]
+                self.assertEqual(before, totals[1:] + [[0, 0]])
+            self.assertEqual(len(pages), 3)
+            self.assertEqual(payments, expected)
+
+    def test_pagination_months(self):
+        self.add_payments(2)
+        payments = self.group.payments.order_by("created_at", "id")
+        for payment, (month, day) in zip(payments, [(2, 1), (2, 28), (3, 1), (3, 2)]):
+            Payment.objects.filter(pk=payment.pk).update(
+                created_at=datetime.datetime(2024, month, day, 12, tzinfo=datetime.UTC)
+            )
+        expected = list(self.group.payments.order_by("-created_at", "-id"))
+
+        # Each page holds a month
+        url = self.group.get_absolute_url()
+        response = self.client.get(url)
+        self.assertEqual(response.context["payments"](), expected[:2])
+        response = self.client.get(url, {"before": response.context["next_cursor"]()})
+        self.assertEqual(response.context["payments"](), expected[2:])
+        self.assertIsNone(response.context["next_cursor"]())
+        self.assertContains(response, "Februari 2024")
+
+    @override_settings(BALANCE_CHECKPOINT_INTERVAL=2)
+    @mock.patch.object(PaymentPageMixin, "page_size", 3)
+    def test_running_balances(self):
+        self.add_payments(4)
+        # The pages start after different checkpoints
+        self.assertEqual(
+            BalanceCheckpoint.objects.values("payment").distinct().count(), 4
+        )
+        url = reverse("group-table", kwargs={"code": self.group.code})
+        pages = []
+        params = {}
+        while True:
+            default = self.client.get(url, params).context
+            running = self.client.get(url, {**params, "running": "1"}).context
+            pages.append((default["rows"](), running["rows"]()))
+            if not default["next_cursor"]():
+                break
+            params = {"before": default["next_cursor"]()}
+        self.assertEqual(len(pages), 3)
+
+        # Same running totals for the cells with an entry
+        for default_rows, running_rows in pages:
+            for (payment, cells), (running_payment, running_cells) in zip(
+                default_rows, running_rows
+            ):
+                self.assertEqual(payment, running_payment)
+                self.assertEqual(
+                    [cell if cell[0] is not None else (None, None) for cell in cells],
+                    running_cells,
+                )
+
+        # The checkpoint and the entries with balances take 2 queries
+        cache.clear()
+        with self.assertNumQueries(7):
+            response = self.client.get(url, {**params, "running": "1"})
+        self.assertContains(response, "text-danger")
+
+    def test_explain_queries(self):
+        with self.assertRaises(CommandError):
+            call_command("explain_queries", stdout=io.StringIO())
+        with self.assertRaisesMessage(CommandError, "has no payments"):
+            call_command("explain_queries", group=self.group.code, stdout=io.StringIO())
+        self.add_payments(30)
+        out = io.StringIO()
+        call_command("explain_queries", group=self.group.code, stdout=out)
+        self.assertIn("== Next payments page", out.getvalue())
+        self.assertIn("== Running balances", out.getvalue())
+
+    def test_pagination_invalid_cursor(self):
+        response = self.client.get(self.group.get_absolute_url(), {"before": "x,1"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_fragment_cache(self):
+        self.add_payments(1)
+        url = self.group.get_absolute_url()
+        self.client.get(url)
+        # Only the group version, group, participants and e-mails are queried
+        with self.assertNumQueries(4):
+            self.client.get(url)
+
+        # Adding a payment bumps the version
+        version = self.group.version
+        self.add_payments(1)
+        self.assertEqual(self.group.version, version + 2)
+        with self.assertNumQueries(7):
+            response = self.client.get(url)
+        self.assertEqual(len(response.context["payments"]()), 4)
+
+    def test_conditional_get(self):
+        self.add_payments(1)
+        url = self.group.get_absolute_url()
+        # The first response sets the CSRF cookie, which changes the ETag
+        self.client.get(url)
+        response = self.client.get(url)
+        etag = response.headers["ETag"]
+        self.assertIn("no-cache", response.headers["Cache-Control"])
+
+        # Unchanged group only queries the version
+        with self.assertNumQueries(1):
+            response = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+
+        self.add_payments(1)
+        response = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["ETag"], etag)
+
+    def test_settle_moves_polling(self):
+        self.add_payments(1)
+        Participant.objects.create(group=self.group, name="Carol")
+        expense = Expense(
+            group=self.group,
+            type="expense",
+            amount=Decimal("-3.00"),
+            payer=self.alice,
+            description="Coffee",
+        )
+        expense.save_with_entries(
+            [
+                Entry(payment=expense, participant=self.alice, amount=Decimal("-3.00")),
+                Entry(payment=expense, participant=self.bob, amount=Decimal("3.00")),
+            ]
+        )
+        settle_url = reverse("group-settle", kwargs={"code": self.group.code})
+        moves_url = reverse("group-settle-moves", kwargs={"code": self.group.code})
+
+        # Small groups are solved during the request, without polling
+        with mock.patch("splitzie.models.plan_cache", PlanCache()):
+            response = self.client.get(settle_url)
+        self.assertContains(response, "Bob")
+        self.assertNotContains(response, "hx-get")
+
+        # When the synchronous search times out, it continues in the background
+        get_optimal = Settler.get_optimal
+
+        def time_out(settler, *args, **kwargs):
+            moves = get_optimal(settler, *args, **kwargs)
+            settler.timed_out = True
+            return moves
+
+        executor = mock.Mock()
+        with (
+            mock.patch("splitzie.models.plan_cache", PlanCache()),
+            mock.patch.object(
+                Settler, "get_optimal", autospec=True, side_effect=time_out
+            ),
+            mock.patch("splitzie.settle.ThreadPoolExecutor", return_value=executor),
+        ):
+            response = self.client.get(settle_url)
+            self.assertContains(response, f'hx-get="{moves_url}"')
+            response = self.client.get(moves_url)
+            self.assertContains(response, f'hx-get="{moves_url}"')
+            self.assertContains(response, "Bob")
+            executor.submit.assert_called_once()
+
+            # The background search finishes
+            search, *args = executor.submit.call_args.args
+            search(*args)
+            response = self.client.get(moves_url)
+            self.assertNotContains(response, "hx-get")
+            self.assertContains(response, "Bob")
+
+    def test_qr(self):
+        url = reverse("group-qr", kwargs={"code": self.group.code, "format": "png"})
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(response["Content-Type"], "image/png")
+        self.assertTrue(response.content.startswith(b"\x89PNG"))
+        self.assertIn("max-age", response["Cache-Control"])
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url, headers={"If-None-Match": response["ETag"]})
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get(
+            reverse("group-qr", kwargs={"code": self.group.code, "format": "svg"})
+        )
+        self.assertEqual(response["Content-Type"], "image/svg+xml")
+        response = self.client.get(
+            reverse("group-qr", kwargs={"code": "unknown", "format": "png"})
+        )
+        self.assertEqual(response.status_code, 404)
+
+        # The edit page links to the image instead of inlining it
+        response = self.client.get(
+            reverse("group-edit", kwargs={"code": self.group.code})
+        )
+        self.assertContains(response, f'src="{url}"')
+
+    def test_export(self):
+        self.add_payments(2)
+        url = reverse("group-export", kwargs={"code": self.group.code, "format": "csv"})
+        response = self.client.get(url)
+        self.assertEqual(response["Content-Type"], "text/csv")
+        rows = list(
+            csv.DictReader(io.StringIO(b"".join(response.streaming_content).decode()))
+        )
+        self.assertEqual(len(rows), 8)
+        self.assertEqual(
+            {
+                k: rows[0][k]
+                for k in (
+                    "type",
+                    "description",
+                    "payer",
+                    "total",
+                    "participant",
+                    "amount",
+                )
+            },
+            {
+                "type": "expense",
+                "description": "Groceries",
+                "payer": "Alice",
+                "total": "-10.00",
+                "participant": "Alice",
+                "amount": "-5.00",
+            },
+        )
+        self.assertEqual(rows[2]["description"], "")
+
+        url = reverse(
+            "group-export", kwargs={"code": self.group.code, "format": "ndjson"}
+        )
+        response = self.client.get(url)
+        rows = [
+            json.loads(line)
+            for line in b"".join(response.streaming_content).splitlines()
+        ]
+        self.assertEqual(len(rows), 8)
+        self.assertEqual(rows[3]["amount"], "5.00")
+        self.assertIsNone(rows[3]["total"])
+
+        url = reverse("group-export", kwargs={"code": self.group.code, "format": "xml"})
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_admin_bumps_version(self):
+        self.add_payments(1)
+        request = RequestFactory().post("/")
+        expense_admin = ExpenseAdmin(Expense, admin.site)
+        version = Group.objects.get().version
+        expense_admin.save_related(
+            request, mock.Mock(instance=Expense.objects.get()), [], True
+        )
+        self.assertEqual(Group.objects.get().version, version + 1)
+
+        # Deleted groups are skipped
+        other = Group.objects.create()
+        group_admin = GroupAdmin(Group, admin.site)
+        group_admin.delete_queryset(request, Group.objects.filter(pk=other.pk))
+        self.assertFalse(Group.objects.filter(pk=other.pk).exists())
+
+    def test_export_formulas(self):
+        self.add_payments(1)
+        Expense.objects.update(description="=HYPERLINK(1)")
+        Participant.objects.filter(name="Alice").update(name="@Alice")
+        url = reverse("group-export", kwargs={"code": self.group.code, "format": "csv"})
+        response = self.client.get(url)
+        rows = list(
+            csv.DictReader(io.StringIO(b"".join(response.streaming_content).decode()))
+        )
+        self.assertEqual(rows[0]["description"], "'=HYPERLINK(1)")
+        self.assertEqual(rows[0]["payer"], "'@Alice")
+        # Amounts are not text
+        self.assertEqual(rows[0]["total"], "-10.00")
+
+
+class MailQueueTestCase(TestCase):
+    def setUp(self):
+        self.group = Group.objects.create()
+        self.alice = Participant.objects.create(group=self.group, name="Alice")
+        self.bob = Participant.objects.create(group=self.group, name="Bob")
+        for i in range(3):
+            LinkedEmail.objects.create(
+                group=self.group, email=f"user{i}@example.com", language="en"
+            )
+
+    def settle(self):
+        form = SettleForm(
+            {"debtor": self.alice.pk, "creditor": self.bob.pk, "amount": "5.00"},
+            instance=Payment(group=self.group, type="settle"),
+        )
+        self.assertTrue(form.is_valid())
+        form.save()
+
+    def test_queue(self):
+        self.settle()
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(QueuedMail.objects.count(), 3)
+
+        call_command("send_queued_mail", "--once", stdout=io.StringIO())
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertFalse(QueuedMail.objects.filter(sent_at=None).exists())
+
+        # Sent mails are not sent again
+        call_command("send_queued_mail", "--once", stdout=io.StringIO())
+        self.assertEqual(len(mail.outbox), 3)
+
+    def test_retry(self):
+        self.settle()
+        with mock.patch(
+            "django.core.mail.EmailMessage.send", side_effect=OSError("Unavailable")
+        ):
+            call_command(
+                "send_queued_mail", "--once", stdout=io.StringIO(), stderr=io.StringIO()
+            )
+        queued = QueuedMail.objects.first()
+        self.assertEqual(queued.attempts, 1)
+        self.assertIsNone(queued.sent_at)
+        self.assertIn("Unavailable", queued.last_error)
+
+        # Not retried before the backoff has passed
+        call_command("send_queued_mail", "--once", stdout=io.StringIO())
+        self.assertEqual(len(mail.outbox), 0)
+        QueuedMail.objects.update(next_attempt_at=queued.created_at)
+        call_command("send_queued_mail", "--once", stdout=io.StringIO())
+        self.assertEqual(len(mail.outbox), 3)
+
+    def test_interrupted(self):
+        self.settle()
+        with mock.patch(
+            "django.core.mail.EmailMessage.send", side_effect=[1, KeyboardInterrupt]
+        ):
+            with self.assertRaises(KeyboardInterrupt):
+                call_command("send_queued_mail", "--once", stdout=io.StringIO())
+        # The sent mail is kept as sent, the others are claimed until the timeout
+        self.assertEqual(QueuedMail.objects.exclude(sent_at=None).count(), 1)
+        self.assertFalse(
+            QueuedMail.objects.filter(next_attempt_at__lte=timezone.now()).exists()
+        )
+        call_command("send_queued_mail", "--once", stdout=io.StringIO())
+        self.assertEqual(len(mail.outbox), 0)
+
+        QueuedMail.objects.update(next_attempt_at=timezone.now())
+        call_command("send_queued_mail", "--once", stdout=io.StringIO())
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_render_once_per_language(self):
+        LinkedEmail.objects.create(
+            group=self.group, email="user@example.nl", language="nl"
+        )
+        with mock.patch(
+            "splitzie.mail.loader.render_to_string", wraps=render_to_string
+        ) as render:
+            self.settle()
+        # Both templates rendered for 2 languages
+        self.assertEqual(render.call_count, 4)
+
+        for linked_email in self.group.emails.all():
+            queued = QueuedMail.objects.get(to=linked_email.email)
+            with translation.override(linked_email.language):
+                url = reverse(
+                    "email-delete",
+                    kwargs={"code": self.group.code, "pk": linked_email.pk},
+                )
+            self.assertIn(url, queued.body)
+
+
+class ImportTestCase(TestCase):
+    def setUp(self):
+        self.group = Group.objects.create()
+        self.alice = Participant.objects.create(group=self.group, name="Alice")
+        self.bob = Participant.objects.create(group=self.group, name="Bob")
+        LinkedEmail.objects.create(
+            group=self.group, email="user@example.com", language="en"
+        )
+        self.url = reverse("group-import", kwargs={"code": self.group.code})
+
+    def upload(self, name: str, content: str):
+        return self.client.post(
+            self.url, {"file": SimpleUploadedFile(name, content.encode())}
+        )
+
+    def test_import_csv(self):
+        rows = [
+            "created_at,type,description,payer,amount,Alice,Bob",
+            "2023-05-01,expense,Groceries,Alice,10.00,5.00,5.00",
+        ]
+        rows += [f",income,Refund {i},Bob,3.00,3.00," for i in range(20)]
+        # Independent of the number of rows
+        with self.assertNumQueries(18):
+            response = self.upload("ledger.csv", "\n".join(rows))
+        self.assertRedirects(response, self.group.get_absolute_url())
+
+        expenses = Expense.objects.filter(group=self.group)
+        self.assertEqual(len(expenses), 21)
+        groceries = expenses.get(description="Groceries")
+        self.assertEqual(groceries.amount, Decimal("-10.00"))
+        self.assertEqual(groceries.type, "expense")
+        self.assertEqual(groceries.payer, self.alice)
+        self.assertFalse(groceries.image)
+        self.assertFalse(groceries.thumbnail)
+        self.assertIsNone(groceries.image_processed_at)
+        refund = expenses.get(description="Refund 0")
+        self.assertEqual((refund.amount, refund.payer), (Decimal("3.00"), self.bob))
+        self.assertEqual(
+            timezone.localdate(groceries.created_at).isoformat(), "2023-05-01"
+        )
+        self.assertEqual(
+            sorted(e.amount for e in groceries.entries.all()),
+            [Decimal("-5.00"), Decimal("5.00")],
+        )
+        self.alice.refresh_from_db()
+        self.bob.refresh_from_db()
+        self.assertEqual(self.alice.balance, Decimal("65.00"))
+        self.assertEqual(self.bob.balance, Decimal("-65.00"))
+        self.assertEqual(
+            self.group.get_balances(),
+            [(self.alice, Decimal("65.00")), (self.bob, Decimal("-65.00"))],
+        )
+
+        # A single summary mail
+        queued = QueuedMail.objects.get()
+        self.assertIn("21 payments were imported", queued.body)
+
+    def test_import_errors(self):
+        rows = [
+            "type,description,payer,amount,Alice,Bob,Carol",
+            "expense,Groceries,Alice,10.00,5.00,5.00,",
+            "expense,Dinner,Alice,10.00,5.00,4.00,",
+            "expense,Lunch,Dave,10.00,5.00,5.00,",
+            "expense,Taxi,Alice,10.00,5.00,,5.00",
+            "income,Refund,Bob,3.00,,3.00,",
+        ]
+        response = self.upload("ledger.csv", "\n".join(rows))
+        errors = response.context["form"].errors["file"]
+        self.assertEqual(len(errors), 4)
+        self.assertTrue(errors[0].startswith("Row 2: "))
+        self.assertTrue(errors[1].startswith("Row 3: payer: "))
+        self.assertIn("Carol", errors[2])
+        self.assertTrue(errors[3].startswith("Row 5: "))
+        self.assertFalse(Payment.objects.exists())
+        self.assertFalse(QueuedMail.objects.exists())
+
+        response = self.upload("ledger.xlsx", "x")
+        self.assertIn("Unknown format", response.context["form"].errors["file"][0])
+
+    def test_import_command(self):
+        rows = [
+            {
+                "type": "expense",
+                "description": "Groceries",
+                "payer": "Bob",
+                "amount": "4.50",
+                "division": {"Alice": "1.50", "Bob": "3.00"},
+            }
+        ]
+        with tempfile.NamedTemporaryFile("w", suffix=".json") as f:
+            json.dump(rows, f)
+            f.flush()
+            out = io.StringIO()
+            call_command("import_expenses", self.group.code, f.name, stdout=out)
+        self.assertIn("Imported 1 expense(s)", out.getvalue())
+        self.bob.refresh_from_db()
+        self.assertEqual(self.bob.balance, Decimal("1.50"))
+
+        with self.assertRaises(CommandError):
+            call_command("import_expenses", "unknown", f.name)
+
+    def test_import_json_division(self):
+        row = {"type": "expense", "description": "Groceries", "payer": "Bob"}
+        rows = [
+            {**row, "amount": "4.50", "division": ["Alice", "Bob"]},
+            {**row, "amount": "1.00", "division": "Alice"},
+        ]
+        response = self.upload("ledger.json", json.dumps(rows))
+        errors = response.context["form"].errors["file"]
+        self.assertEqual(len(errors), 2)
+        self.assertTrue(errors[0].startswith("Row 1: The division must be"))
+        self.assertTrue(errors[1].startswith("Row 2: The division must be"))
+        self.assertFalse(Payment.objects.exists())
+
+
+class ImageTestCase(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(self.settings(MEDIA_ROOT=media_root.name))
+
+        group = Group.objects.create()
+        alice = Participant.objects.create(group=group, name="Alice")
+        image = Image.new("RGB", (3000, 2000), "red")
+        exif = Image.Exif()
+        exif[0x010F] = "Phone"  # Make
+        buffered = io.BytesIO()
+        image.save(buffered, "JPEG", exif=exif)
+        self.expense = Expense(
+            group=group,
+            type="expense",
+            amount=Decimal("0.00"),
+            payer=alice,
+            description="Receipt",
+            image=SimpleUploadedFile("receipt.jpg", buffered.getvalue()),
+        )
+        self.expense.save()
+
+    def test_process_images(self):
+        original = self.expense.image.path
+        with self.captureOnCommitCallbacks() as callbacks:
+            call_command("process_images", "--once", stdout=io.StringIO())
+        # The original is only deleted after the commit
+        self.assertTrue(os.path.exists(original))
+        for callback in callbacks:
+            callback()
+        self.expense.refresh_from_db()
+        self.assertIsNotNone(self.expense.image_processed_at)
+        self.assertFalse(os.path.exists(original))
+        self.assertTrue(self.expense.image.name.endswith(".webp"))
+        self.assertTrue(self.expense.thumbnail.name.endswith(".webp"))
+        with Image.open(self.expense.image.path) as image:
+            self.assertEqual(image.format, "WEBP")
+            self.assertEqual(image.size, (1600, 1067))
+            self.assertFalse(image.getexif())
+        with Image.open(self.expense.thumbnail.path) as thumbnail:
+            self.assertEqual(thumbnail.size, (400, 267))
+
+        response = self.client.get(self.expense.get_absolute_url())
+        self.assertContains(response, self.expense.thumbnail.url)
+
+    def test_process_claimed_image(self):
+        # Claimed by another worker
+        Expense.objects.update(image_claimed_at=timezone.now())
+        call_command("process_images", "--once", stdout=io.StringIO())
+        self.expense.refresh_from_db()
+        self.assertIsNone(self.expense.image_processed_at)
+
+        # The claim has expired
+        Expense.objects.update(
+            image_claimed_at=timezone.now() - datetime.timedelta(hours=1)
+        )
+        call_command("process_images", "--once", stdout=io.StringIO())
+        self.expense.refresh_from_db()
+        self.assertIsNotNone(self.expense.image_processed_at)
+
+    def test_process_invalid_image(self):
+        with open(self.expense.image.path, "wb") as f:
+            f.write(b"not an image")
+        err = io.StringIO()
+        call_command("process_images", "--once", stdout=io.StringIO(), stderr=err)
+        self.assertIn("Failed to process image", err.getvalue())
+        self.expense.refresh_from_db()
+        self.assertIsNotNone(self.expense.image_processed_at)
+        self.assertFalse(self.expense.thumbnail)
+
+
+class LoadTestCase(TestCase):
+    @override_settings(BALANCE_CHECKPOINT_INTERVAL=20)
+    def test_seed_load(self):
+        call_command(
+            "seed_load",
+            "--groups=5",
+            "--payments",
+            "30",
+            "60",
+            stdout=io.StringIO(),
+        )
+        self.assertEqual(Group.objects.count(), 5)
+        self.assertTrue(BalanceCheckpoint.objects.exists())
+        # The balances and checkpoints match the entries, summed in Python
+        # because SQLite sums the amounts as floats
+        for group in Group.objects.all():
+            payments = list(
+                group.payments.order_by("created_at", "id").prefetch_related("entries")
+            )
+            self.assertEqual(group.payments_since_checkpoint, len(payments) % 20)
+            self.assertLess(group.created_at, payments[0].created_at)
+            # The generated history is kept instead of the current time
+            self.assertLess(
+                payments[0].created_at, timezone.now() - datetime.timedelta(hours=1)
+            )
+            balances = {p.pk: Decimal("0.00") for p in group.participants.all()}
+            for payment in payments:
+                for entry in payment.entries.all():
+                    balances[entry.participant_id] += entry.amount
+                for checkpoint in payment.checkpoints.all():
+                    self.assertEqual(
+                        checkpoint.balance, balances[checkpoint.participant_id]
+                    )
+            self.assertEqual(
+                {p.pk: p.balance for p in group.participants.all()}, balances
+            )
+
+        # The steps that sum balances fail on SQLite
+        steps = ["group", "table", "create expense", "edit group"]
+        out = io.StringIO()
+        call_command("load_test", "--iterations=3", "--steps", *steps, stdout=out)
+        lines = out.getvalue().splitlines()[1:]
+        self.assertEqual([line.rsplit(None, 7)[0] for line in lines], steps)
+        # Requests and errors
+        self.assertEqual([line.split()[-7:-5] for line in lines], [["3", "0"]] * 4)
+
+
+@override_settings(INSTRUMENT_REQUESTS=True)
+class InstrumentationTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.group = Group.objects.create()
+        for name in ("Alice", "Bob"):
+            Participant.objects.create(group=self.group, name=name)
+
+    def test_server_timing(self):
+        with self.assertLogs("splitzie.middleware", "DEBUG") as logs:
+            response = self.client.get(reverse("group-edit", args=(self.group.code,)))
+        self.assertRegex(
+            response.headers["Server-Timing"],
+            r'^db;dur=[\d.]+;desc="\d+ queries", tpl;dur=[\d.]+, total;dur=[\d.]+, '
+            rf'size;desc="{len(response.content)} bytes"$',
+        )
+        self.assertIn("group-edit 200", logs.output[0])
+
+    def test_streaming(self):
+        Payment.objects.create(group=self.group, type="settle")
+        url = reverse("group-export", kwargs={"code": self.group.code, "format": "csv"})
+        with self.assertLogs("splitzie.middleware", "DEBUG") as logs:
+            response = self.client.get(url)
+            self.assertNotIn("Server-Timing", response.headers)
+            self.assertEqual(logs.output, [])
+            # The queries of the content are logged once it is consumed
+            content = b"".join(response.streaming_content)
+        self.assertRegex(
+            logs.output[0],
+            rf"group-export 200: [1-9]\d* queries .* {len(content)} bytes$",
+        )
+
+    @override_settings(SLOW_REQUEST_QUERIES=2)
+    def test_slow_request(self):
+        with self.assertLogs("splitzie.middleware", "WARNING") as logs:
+            self.client.get(reverse("group-table", args=(self.group.code,)))
+        self.assertIn("Slow request group-table 200", logs.output[0])
@@ -33,6 +33,11 @@ urlpatterns = i18n_patterns(
                 path("edit/", views.GroupEditView.as_view(), name="group-edit"),
                 path("add/", views.ExpenseCreateView.as_view(), name="expense-create"),
                 path("settle/", views.GroupSettleView.as_view(), name="group-settle"),
+                path(
+                    "settle/moves/",
+                    views.GroupSettleMovesView.as_view(),
+                    name="group-settle-moves",
+                ),
                 path(
                     "expense/<int:pk>/",
                     views.ExpenseDetailView.as_view(),
@@ -44,6 +49,13 @@ urlpatterns = i18n_patterns(
                     name="email-delete",
                 ),
                 path("table/", views.GroupTableView.as_view(), name="group-table"),
+                path("import/", views.GroupImportView.as_view(), name="group-import"),
+                path("qr.<format>", views.GroupQRView.as_view(), name="group-qr"),
+                path(
+                    "export.<format>",
+                    views.GroupExportView.as_view(),
+                    name="group-export",
+                ),
             ]
         ),
     ),
@@ -1,28 +1,76 @@
-import base64
-import io
+import datetime
+import hashlib
 import random
+from decimal import Decimal
 
-import qrcode
-import qrcode.image.svg
 from django.conf import settings
 from django.core.exceptions import BadRequest
 from django.db import transaction
+from django.db.models import Prefetch, Q
 from django.forms import modelform_factory
-from django.http import HttpResponse, HttpResponseRedirect
+from django.http import (
+    HttpResponse,
+    HttpResponseRedirect,
+    StreamingHttpResponse,
+    Http404,
+)
 from django.shortcuts import render
 from django.urls import reverse
-from django.utils.safestring import mark_safe
+from django.utils import timezone
+from django.utils.decorators import method_decorator
+from django.utils.functional import cached_property
 from django.utils.translation import get_language
 from django.views import View
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
 from django.views.generic import (
     TemplateView,
     DetailView,
 )
 from django.views.generic.detail import SingleObjectMixin
 
-from splitzie.forms import ExpenseForm, SettleForm
-from splitzie.mail import send_rendered_mail
-from splitzie.models import Group, Expense, Participant, LinkedEmail, Payment
+from splitzie import export, qr
+from splitzie.forms import ExpenseForm, SettleForm, ExpenseImportForm
+from splitzie.models import (
+    Group,
+    Expense,
+    Participant,
+    LinkedEmail,
+    Payment,
+    Entry,
+    BalanceCheckpoint,
+)
+
+
+def get_group_marker(request, code) -> tuple[int, datetime.datetime] | None:
+    """Returns the version and change time of the group, memoized on the request."""
+    if not hasattr(request, "group_marker"):
+        request.group_marker = (
+            Group.objects.filter(code=code).values_list("version", "changed_at").first()
+        )
+    return request.group_marker
+
+
+def group_etag(request, code, **kwargs) -> str | None:
+    marker = get_group_marker(request, code)
+    if marker is None:
+        return None
+    # The page contains a CSRF token, which depends on the cookie
+    csrf_cookie = request.COOKIES.get(settings.CSRF_COOKIE_NAME, "")
+    return f"{marker[0]}-{hashlib.md5(csrf_cookie.encode(), usedforsecurity=False).hexdigest()}"
+
+
+def group_last_modified(request, code, **kwargs) -> datetime.datetime | None:
+    marker = get_group_marker(request, code)
+    return marker[1] if marker else None
+
+
+# For pages that only change with the group version. The browser has to
+# revalidate each time, which is answered with 304 Not Modified when unchanged.
+group_conditional = [
+    cache_control(private=True, no_cache=True),
+    condition(etag_func=group_etag, last_modified_func=group_last_modified),
+]
 
 
 class IndexView(TemplateView):
@@ -36,12 +84,181 @@ class GroupMixin(SingleObjectMixin):
     slug_url_kwarg = "code"
 
 
-class GroupView(GroupMixin, DetailView):
+class PaymentPageMixin(GroupMixin):
+    """Keyset pagination of the group payments, newest first.
+
+    Each page holds the payments of a month, up to page_size. Months with
+    more payments continue on the next page. Pages are requested with a
+    `before` cursor, which consists of the creation time and ID of the last
+    payment on the previous page. These requests only render the fragment
+    template, to be appended by HTMX.
+    """
+
+    page_size = 100
+    fragment_template_name = None
+
+    def get_cursor(self) -> tuple[datetime.datetime, int] | None:
+        before = self.request.GET.get("before")
+        if not before:
+            return None
+        try:
+            created_at, pk = before.rsplit(",", 1)
+            created_at, pk = datetime.datetime.fromisoformat(created_at), int(pk)
+        except ValueError:
+            raise BadRequest
+        if created_at.tzinfo is None:
+            raise BadRequest
+        return created_at, pk
+
+    def get_payments_page(self, payments) -> tuple[list[Payment], str | None]:
+        """Returns the payments of the current page and the cursor for the next page."""
+        payments = payments.order_by("-created_at", "-id")
+        cursor = self.get_cursor()
+        if cursor:
+            created_at, pk = cursor
+            payments = payments.filter(
+                Q(created_at__lt=created_at) | Q(created_at=created_at, pk__lt=pk)
+            )
+        # The page is selected on the keys only, which are read from the index
+        keys = list(payments.values_list("created_at", "pk")[: self.page_size + 1])
+        if not keys:
+            return [], None
+        month = timezone.localtime(keys[0][0]).replace(
+            day=1, hour=0, minute=0, second=0, microsecond=0
+        )
+        page_keys = [k for k in keys if k[0] >= month][: self.page_size]
+        page = list(payments.filter(pk__in=[pk for _, pk in page_keys]))
+        if len(page_keys) == len(keys):
+            return page, None
+        return page, f"{page[-1].created_at.isoformat()},{page[-1].pk}"
+
+    def get_template_names(self):
+        if self.get_cursor():
+            return [self.fragment_template_name]
+        return super().get_template_names()
+
+
+@method_decorator(group_conditional, name="get")
+class GroupView(PaymentPageMixin, DetailView):
     template_name = "splitzie/group.html"
+    fragment_template_name = "splitzie/snippets/payment_list.html"
+
+    @cached_property
+    def page(self) -> tuple[list[Payment], str | None]:
+        # Fetch everything the timeline needs up front, to avoid a query per payment
+        return self.get_payments_page(
+            self.object.payments.select_related("expense__payer").prefetch_related(
+                Prefetch(
+                    "entries", queryset=Entry.objects.select_related("participant")
+                )
+            )
+        )
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        cursor = self.get_cursor()
+        context.update(
+            {
+                "participants": list(self.object.participants.all()),
+                # Callables are only evaluated when the cached fragment is missing
+                "payments": lambda: self.page[0],
+                "next_cursor": lambda: self.page[1],
+                # Used to continue the month of the previous page
+                "previous_created_at": cursor[0] if cursor else None,
+            }
+        )
+        return context
 
-class GroupTableView(GroupMixin, DetailView):
+
+@method_decorator(group_conditional, name="get")
+class GroupTableView(PaymentPageMixin, DetailView):
     template_name = "splitzie/group_table.html"
+    fragment_template_name = "splitzie/snippets/table_rows.html"
+
+    def get_table(self):
+        """Pivots the entries of the current page into a payment by participant matrix.
+
+        Returns:
+            The participants, the payment rows, the cursor for the next page
+            and the current balances. Each row is a two-tuple of the payment
+            and the cells. Each cell is a two-tuple of the entry amount (or
+            None) and the running total of that participant after the
+            payment. In running mode, the running total is computed in the
+            entries query and is None for cells without entry.
+        """
+        participants = self.participants
+        payments, next_cursor = self.get_payments_page(self.object.payments.all())
+        totals = [p.balance for p in participants]
+
+        if self.running:
+            # Only cells with an entry get a running balance
+            entries = Entry.objects.running_balances(self.object, payments)
+            rows = [
+                (
+                    payment,
+                    [
+                        entries.get((payment.pk, p.pk), (None, None))
+                        for p in participants
+                    ],
+                )
+                for payment in payments
+            ]
+            return participants, rows, next_cursor, totals
+
+        amounts = {
+            (payment, participant): amount
+            for payment, participant, amount in Entry.objects.filter(
+                payment__in=payments
+            ).values_list("payment", "participant", "amount")
+        }
+
+        # Running totals are computed backwards from the balances after the
+        # newest payment of this page, which directly precedes the cursor.
+        running = list(totals)
+        cursor = self.get_cursor()
+        if cursor:
+            created_at, pk = cursor
+            balances = BalanceCheckpoint.objects.balances(
+                self.object, (created_at, pk - 1)
+            )
+            running = [balances.get(p.pk, Decimal("0.00")) for p in participants]
+        rows = []
+        for payment in payments:
+            cells = []
+            for i, participant in enumerate(participants):
+                amount = amounts.get((payment.pk, participant.pk))
+                cells.append((amount, running[i]))
+                if amount is not None:
+                    running[i] -= amount
+            rows.append((payment, cells))
+        return participants, rows, next_cursor, totals
+
+    @cached_property
+    def running(self) -> bool:
+        """Whether the running balances are shown in the cells."""
+        return self.request.GET.get("running") == "1"
+
+    @cached_property
+    def participants(self) -> list[Participant]:
+        return list(self.object.participants.all())
+
+    @cached_property
+    def table(self):
+        return self.get_table()
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context.update(
+            {
+                "participants": self.participants,
+                "running": self.running,
+                # Callables are only evaluated when the cached fragment is missing
+                "rows": lambda: self.table[1],
+                "next_cursor": lambda: self.table[2],
+                "totals": lambda: self.table[3],
+            }
+        )
+        return context
 
 
 class GroupCreateView(View):
@@ -57,52 +274,25 @@ class GroupCreateView(View):
         return response
 
 
-class GroupEditView(GroupMixin, DetailView):
-    template_name = "splitzie/group_form.html"
+class GroupExportView(GroupMixin, View):
+    """Streams the group ledger as CSV or newline-delimited JSON."""
 
-    def get_qr_svg(self) -> str:
-        # Deprecated: use PNG
-        if not self.object:
-            raise ValueError("Group missing")
-        url = self.request.build_absolute_uri(
-            reverse("group", kwargs={"code": self.object.code})
+    def get(self, request, *args, **kwargs):
+        if kwargs["format"] not in export.FORMATS:
+            raise Http404
+        group = self.get_object()
+        content_type, lines = export.FORMATS[kwargs["format"]]
+        response = StreamingHttpResponse(
+            lines(export.ledger_rows(group)), content_type=content_type
         )
-
-        qr = qrcode.QRCode(
-            version=None,
-            image_factory=qrcode.image.svg.SvgPathImage,
-            box_size=10,
+        response.headers["Content-Disposition"] = (
+            f'attachment; filename="{group.code}.{kwargs["format"]}"'
         )
-        qr.add_data(url)
-        qr.make(fit=True)
-        return qr.make_image().to_string(encoding="unicode")
-
-    def get_qr_png_uri(self) -> str:
-        if not self.object:
-            raise ValueError("Group missing")
-        url = settings.BASE_URL + reverse("group", kwargs={"code": self.object.code})
+        return response
 
-        qr = qrcode.QRCode(
-            box_size=5,
-            border=5,
-        )
-        qr.add_data(url)
-        qr.make()
-        img = qr.make_image()
-        buffered = io.BytesIO()
-        img.save(buffered)
-        data = base64.b64encode(buffered.getvalue()).decode("utf-8")
-        return f"data:image/png;base64,{data}"
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context.update(
-            {
-                # "qr_svg": mark_safe(self.get_qr_svg()),
-                "qr_png_uri": mark_safe(self.get_qr_png_uri()),
-            }
-        )
-        return context
+class GroupEditView(GroupMixin, DetailView):
+    template_name = "splitzie/group_form.html"
 
     def handle_name(self):
         form = modelform_factory(Group, fields=["name"])(
@@ -110,7 +300,9 @@ class GroupEditView(GroupMixin, DetailView):
         )
         if not form.is_valid():
             raise BadRequest
-        form.save()
+        # Only save the name, the version might have changed in the meantime
+        form.save(commit=False).save(update_fields=["name"])
+        self.object.bump_version()
 
     def handle_participant_create(self):
         form = modelform_factory(Participant, fields=["name"])(
@@ -119,6 +311,7 @@ class GroupEditView(GroupMixin, DetailView):
         if not form.is_valid():
             raise BadRequest
         form.save()
+        self.object.bump_version()
 
     def handle_participant_delete(self):
         try:
@@ -128,6 +321,7 @@ class GroupEditView(GroupMixin, DetailView):
         except Participant.DoesNotExist:
             raise BadRequest
         participant.delete()
+        self.object.bump_version()
 
     def handle_email_create(self):
         form = modelform_factory(LinkedEmail, fields=["email"])(
@@ -138,6 +332,7 @@ class GroupEditView(GroupMixin, DetailView):
             raise BadRequest
         with transaction.atomic():
             linked_email = form.save()  # type: LinkedEmail
+            self.object.bump_version()
             linked_email.send_mail(
                 "splitzie/mails/email_added.txt",
                 "splitzie/mails/email_added_subject.txt",
@@ -153,6 +348,7 @@ class GroupEditView(GroupMixin, DetailView):
             raise BadRequest
         with transaction.atomic():
             email.delete()
+            self.object.bump_version()
             email.send_mail(
                 "splitzie/mails/email_removed.txt",
                 "splitzie/mails/email_removed_subject.txt",
@@ -184,9 +380,20 @@ class EmailDeleteView(View):
     pass
 
 
+@method_decorator(group_conditional, name="get")
 class GroupSettleView(GroupMixin, DetailView):
     template_name = "splitzie/group_settle.html"
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # The moves are not cached, because they may improve without a group
+        # change, so the balances are needed for every request
+        context["balances"] = self.object.get_balances()
+        context["moves"], context["moves_final"] = self.object.get_moves_anytime(
+            context["balances"]
+        )
+        return context
+
     def post(self, request, *args, **kwargs):
         self.object = self.get_object()
         form = SettleForm(
@@ -198,6 +405,64 @@ class GroupSettleView(GroupMixin, DetailView):
         return self.render_to_response(self.get_context_data(form=form))
 
 
+class GroupSettleMovesView(GroupMixin, DetailView):
+    """Polled by the settle page until the background search has finished.
+
+    Not conditional, because the moves may improve without a group change.
+    """
+
+    template_name = "splitzie/snippets/settle_moves.html"
+    http_method_names = ["get"]
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["moves"], context["moves_final"] = self.object.get_moves_anytime()
+        return context
+
+
+class GroupQRView(View):
+    """QR code image of the group URL.
+
+    The image only depends on the URL, so it can be cached for a long time.
+    """
+
+    @staticmethod
+    def get_url(code: str) -> str:
+        return settings.BASE_URL + reverse("group", kwargs={"code": code})
+
+    @method_decorator(cache_control(private=True, max_age=30 * 24 * 60 * 60))
+    @method_decorator(
+        condition(
+            etag_func=lambda request, code, format: qr.qr_etag(
+                GroupQRView.get_url(code), format
+            )
+        )
+    )
+    def get(self, request, code, format):
+        if format not in qr.FORMATS or not Group.objects.filter(code=code).exists():
+            raise Http404
+        return HttpResponse(
+            qr.make_qr(GroupQRView.get_url(code), format),
+            content_type=qr.FORMATS[format],
+        )
+
+
+class GroupImportView(GroupMixin, DetailView):
+    template_name = "splitzie/group_import.html"
+
+    def get_context_data(self, **kwargs):
+        kwargs.setdefault("form", ExpenseImportForm(group=self.object))
+        return super().get_context_data(**kwargs)
+
+    def post(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        form = ExpenseImportForm(request.POST, request.FILES, group=self.object)
+        if not form.is_valid():
+            return self.render_to_response(self.get_context_data(form=form))
+        form.save()
+        return HttpResponseRedirect(self.object.get_absolute_url())
+
+
 class ExpenseCreateView(GroupMixin, DetailView):
     template_name = "splitzie/expense_form.html"
 
@@ -236,6 +501,7 @@ class ExpenseCreateView(GroupMixin, DetailView):
         return response
 
 
+@method_decorator(group_conditional, name="get")
 class ExpenseDetailView(DetailView):
     model = Expense
     slug_url_kwarg = "code"